@@ -1,11 +1,16 @@
-import os
+import queue
 import pydicom
+import threading
 import numpy as np
 import tkinter as tk
 import matplotlib.pyplot as plt
-from matplotlib.patches import Rectangle
 from tkinter import filedialog, messagebox
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from SliceView import SliceView
+from SharedVolume import SharedVolume
+from SliceCache import SliceCache, default_window
+from dicom_series import index_series, series_shape, stream_series
+from volume_store import open_volume
 
 
 class DicomViewerPage1(tk.Frame):
@@ -17,8 +22,12 @@ class DicomViewerPage1(tk.Frame):
         self.master = master
         self.dicom_data = None
         self.vol_data = None
+        self.volume = None  # SharedVolume (with its display pyramid) once a volume is fully loaded
         self.middle_slice_idx = 0
-        self.rectangle = None
+        self.z_lo = self.z_hi = 0  # Range of slices loaded so far
+        self.load_queue = None
+        self.load_cancel = None
+        self.cache = None
         self.fig, self.ax = plt.subplots(figsize=(7, 6))
         self.fig.patch.set_facecolor('#323232')
         self.ax.set_facecolor('#424242')
@@ -54,6 +63,23 @@ class DicomViewerPage1(tk.Frame):
                                           pady=10)
         self.multi_browse_btn.pack(side="left", padx=10)
 
+        # Cancel button for a running multi-file load
+        self.cancel_btn = tk.Button(browse_frame,
+                                    text="Cancel",
+                                    command=self.cancel_loading,
+                                    state="disabled",
+                                    bg="#555555",
+                                    fg="white",
+                                    font=("Helvetica", 14, "bold"),
+                                    relief="groove",
+                                    padx=10,
+                                    pady=10)
+        self.cancel_btn.pack(side="left", padx=10)
+
+        # Loading progress
+        self.status_label = tk.Label(browse_frame, text="", bg='#323232', fg="white", font=("Helvetica", 12))
+        self.status_label.pack(side="left", padx=10)
+
         # Frame for canvas and scrollbar
         self.canvas_frame = tk.Frame(self, bg='#323232')
         self.canvas_frame.pack(pady=10)
@@ -65,6 +91,7 @@ class DicomViewerPage1(tk.Frame):
         # Matplotlib canvas
         self.canvas = FigureCanvasTkAgg(self.fig, master=self.canvas_frame)
         self.canvas.get_tk_widget().pack(side="left", fill="both", expand=True)
+        self.view = SliceView(self.ax, self.canvas)
 
         # Frame for buttons
         button_frame = tk.Frame(self, bg='#323232')
@@ -96,131 +123,219 @@ class DicomViewerPage1(tk.Frame):
 
         # Bind rectangle drawing
         self.drawing_rectangle = False
-        self.rectangle = None
         self.canvas.mpl_connect("button_press_event", self.start_rectangle)
         self.canvas.mpl_connect("motion_notify_event", self.update_rectangle)
         self.canvas.mpl_connect("button_release_event", self.finalize_rectangle)
 
     def reset_drawing(self):
         """Reset the drawing by clearing the rectangle."""
-        if self.rectangle:
-            self.rectangle.remove()  # Remove the current rectangle patch
-            self.rectangle = None  # Reset the rectangle variable
-
-        # Redraw the canvas to reflect the cleared drawing
-        self.canvas.draw()
+        self.view.clear_rectangle()
 
     def load_single(self):
-        """Load the DICOM file and display the initial slice."""
-        dicom_path = filedialog.askopenfilename(filetypes=[("DICOM Files", "*.dcm")])
+        """Load the DICOM (or volume) file and display the initial slice."""
+        dicom_path = filedialog.askopenfilename(filetypes=[("DICOM Files", "*.dcm"), ("Volume Files", "*.vol")])
         if not dicom_path:
             return
 
-        # Load DICOM data
-        self.dicom_data = pydicom.dcmread(dicom_path)
-        self.vol_data = self.dicom_data.pixel_array
+        # Detach a running load, so its late messages can't replace this volume
+        self.cancel_loading()
+        self.load_queue = None
+        self.cancel_btn.config(state="disabled")
+        self.status_label.config(text="")
+
+        # Load DICOM data, or open a preprocessed volume lazily
+        if dicom_path.endswith(".vol"):
+            self.vol_data = open_volume(dicom_path)
+        else:
+            self.dicom_data = pydicom.dcmread(dicom_path)
+            self.vol_data = self.dicom_data.pixel_array
+        self.volume = SharedVolume(self.vol_data)
         self.middle_slice_idx = self.vol_data.shape[0] // 2
+        self.z_lo, self.z_hi = 0, self.vol_data.shape[0]
+        self.reset_cache()
 
         # Configure scrollbar
-        self.scrollbar.config(command=self.scroll_image)
-        self.scrollbar.set(self.middle_slice_idx / (self.vol_data.shape[0] - 1),
-                           (self.middle_slice_idx + 1) / (self.vol_data.shape[0] - 1))
+        self.update_scrollbar()
 
         # Display initial slice
         self.update_image()
 
     def load_multi(self):
-        """Load a folder of DICOM files and create a 3D volume."""
+        """Load a folder of DICOM files into a 3D volume on a background thread."""
         dicom_folder = filedialog.askdirectory()
         if not dicom_folder:
             return
 
-        # Show a message to wait
-        wait_message = tk.Label(self.master, text="Please wait... Loading files.",
-                                fg="red", font=("Arial", 20, "bold"))
-        wait_message.place(relx=0.5, rely=0.5, anchor="center")  # Center the message
-        self.master.update()  # Force update to show the message
+        self.cancel_loading()
 
-        slices = []
-        for file in os.listdir(dicom_folder):
-            file_path = os.path.join(dicom_folder, file)
+        # Each load gets its own queue and cancel flag, so a stale worker can't touch a newer load
+        self.load_queue = queue.Queue()
+        self.load_cancel = threading.Event()
+        threading.Thread(target=self.load_worker,
+                         args=(dicom_folder, self.load_queue, self.load_cancel),
+                         daemon=True).start()
 
-            dcom_data = pydicom.dcmread(file_path)
-            if len(dcom_data.pixel_array.shape) == 2:
-                instance_number = int(dcom_data.InstanceNumber)
-                slices.append((instance_number, dcom_data.pixel_array))
+        self.status_label.config(text="Reading headers...")
+        self.cancel_btn.config(state="normal")
+        self.after(30, self.poll_loading, self.load_queue)
 
-        slices = sorted(slices, key=lambda x: x[0])
-        sorted_pixel_arrays = [slice[1] for slice in slices]
-        self.vol_data = np.stack(sorted_pixel_arrays, axis=0)
-        self.middle_slice_idx = self.vol_data.shape[0] // 2
+    def load_worker(self, dicom_folder, load_queue, cancel):
+        """Decode the series off the Tk thread, reporting every stored slice through the queue."""
+        try:
+            index = index_series(dicom_folder)
+            if not index["slices"]:
+                raise ValueError(f"No single-frame DICOM slices found in {dicom_folder}")
 
-        # Configure scrollbar
-        self.scrollbar.config(command=self.scroll_image)
-        self.scrollbar.set(self.middle_slice_idx / (self.vol_data.shape[0] - 1),
-                           (self.middle_slice_idx + 1) / (self.vol_data.shape[0] - 1))
+            vol_data = np.empty(series_shape(index), dtype=index["slices"][0]["dtype"])
+            load_queue.put(("start", vol_data))
 
-        # Display initial slice
-        self.update_image()
+            for z in stream_series(dicom_folder, vol_data, index, cancel=cancel):
+                load_queue.put(("slice", z))
+
+            load_queue.put(("done", None))
+        except Exception as e:
+            load_queue.put(("error", str(e)))
 
-        # Remove the wait message
-        wait_message.destroy()
-        self.master.update()
+    def poll_loading(self, load_queue):
+        """Apply the loader's progress to the page (runs on the Tk thread)."""
+        if load_queue is not self.load_queue:
+            return
+
+        show_first = False
+        while True:
+            try:
+                kind, value = load_queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if kind == "start":
+                self.vol_data = value
+                self.volume = None
+                self.middle_slice_idx = self.z_lo = self.z_hi = value.shape[0] // 2
+            elif kind == "slice":
+                # Slices arrive middle-out, so the loaded range stays contiguous
+                show_first = show_first or self.z_lo == self.z_hi
+                self.z_lo, self.z_hi = min(self.z_lo, value), max(self.z_hi, value + 1)
+            elif kind == "done":
+                self.finish_loading()
+                return
+            elif kind == "error":
+                self.load_queue = None
+                self.cancel_btn.config(state="disabled")
+                self.status_label.config(text="")
+                messagebox.showerror("Error", value)
+                return
+
+        if self.vol_data is not None and self.z_hi > self.z_lo:
+            self.status_label.config(text=f"Loading... {self.z_hi - self.z_lo}/{self.vol_data.shape[0]} slices")
+            self.update_scrollbar()
+            if show_first:
+                # Window/level from the middle slice until the whole series is in
+                self.reset_cache(default_window(self.vol_data[self.z_lo:self.z_hi]))
+                self.update_image()
+
+        self.after(30, self.poll_loading, load_queue)
+
+    def finish_loading(self):
+        """Wrap up a finished (or cancelled) load."""
+        loaded = self.z_hi - self.z_lo
+        if self.load_cancel.is_set() and loaded < self.vol_data.shape[0]:
+            # Keep a copy of the contiguous part that was loaded before cancelling,
+            # a view would keep the whole preallocated volume alive
+            self.vol_data = self.vol_data[self.z_lo:self.z_hi].copy()
+            self.middle_slice_idx -= self.z_lo
+            self.z_lo, self.z_hi = 0, loaded
+            self.status_label.config(text=f"Cancelled, {loaded} slices loaded")
+        else:
+            self.status_label.config(text="")
+
+        self.load_queue = None
+        self.cancel_btn.config(state="disabled")
+        if loaded:
+            self.volume = SharedVolume(self.vol_data)
+            self.reset_cache()
+            self.update_scrollbar()
+            self.update_image()
+
+    def cancel_loading(self):
+        """Stop a running multi-file load, keeping the slices loaded so far."""
+        if self.load_queue is not None:
+            self.load_cancel.set()
+
+    def reset_cache(self, window=None):
+        """Start a fresh display cache for the current volume."""
+        if self.cache is not None:
+            self.cache.close()
+
+        vol_data = self.vol_data
+        if self.volume is not None:
+            get_slice = lambda i, level: self.volume.plane(0, i, level)
+        else:
+            # Still loading: full resolution only, the pyramid is built once the series is in
+            get_slice = lambda i, level: vol_data[i, :, :]
+        self.cache = SliceCache(get_slice, window or default_window(vol_data), vol_data.dtype)
+
+    def destroy(self):
+        """Stop a running load and release the figure before the page goes away."""
+        self.cancel_loading()
+        self.load_queue = None
+        if self.cache is not None:
+            self.cache.close()
+        plt.close(self.fig)
+        super().destroy()
+
+    def update_scrollbar(self):
+        """Place the scrollbar for the current slice within the loaded range."""
+        last = max(self.z_hi - self.z_lo - 1, 1)
+        position = self.middle_slice_idx - self.z_lo
+        self.scrollbar.set(position / last, (position + 1) / last)
 
     def scroll_image(self, *args):
         """Update the slice index and replot the image."""
-        if self.vol_data is not None:
+        if self.vol_data is not None and self.z_hi > self.z_lo:
             if args[0] == "moveto":
                 # Adjust index based on scrollbar position
-                fraction = float(args[1])
-                self.middle_slice_idx = int(fraction * (self.vol_data.shape[0] - 1))
+                fraction = min(max(float(args[1]), 0.0), 1.0)
+                self.middle_slice_idx = self.z_lo + int(fraction * (self.z_hi - self.z_lo - 1))
             elif args[0] == "scroll":
                 # Adjust index based on scroll amount
                 step = int(args[1])
-                self.middle_slice_idx = max(0, min(self.middle_slice_idx + step, self.vol_data.shape[0] - 1))
+                self.middle_slice_idx = max(self.z_lo, min(self.middle_slice_idx + step, self.z_hi - 1))
 
             # Update scrollbar position
-            self.scrollbar.set(self.middle_slice_idx / (self.vol_data.shape[0] - 1),
-                               (self.middle_slice_idx + 1) / (self.vol_data.shape[0] - 1))
+            self.update_scrollbar()
 
             self.update_image()
 
     def update_image(self):
         """Update the displayed image based on the current slice index."""
         if self.vol_data is not None:
-            middle_slice = self.vol_data[self.middle_slice_idx, :, :]
-            self.ax.clear()
-            self.ax.imshow(middle_slice, cmap="gray")
-            self.ax.set_xticks([])  # Remove x-axis ticks
-            self.ax.set_yticks([])  # Remove y-axis ticks
-
-            if self.rectangle:
-                self.ax.add_patch(self.rectangle)
-
-            self.canvas.draw()
+            # Window/levelled uint8 slice, mostly straight from the cache
+            if self.volume is not None:
+                level, extent = self.volume.display_level(self.view), self.volume.plane_extent(0)
+            else:
+                level, extent = 0, None
+            middle_slice = self.cache.get(self.middle_slice_idx, self.z_lo, self.z_hi, level)
+            self.view.show(middle_slice, clim=(0, 255), extent=extent)
 
     def start_rectangle(self, event):
         """Start drawing a rectangle."""
         if event.inaxes:
             # Check if a rectangle already exists, prevent drawing a new one
-            if self.rectangle is not None:
+            if self.view.rectangle is not None:
                 print("A rectangle already exists. Reset before drawing a new one.")
                 return
 
             self.drawing_rectangle = True  # Set flag to indicate drawing has started
             self.rect_start = (event.xdata, event.ydata)
-            self.rectangle = Rectangle(self.rect_start, 0, 0, edgecolor='red', facecolor='none', linewidth=2)
-            self.ax.add_patch(self.rectangle)
+            self.view.begin_rectangle(*self.rect_start)
 
     def update_rectangle(self, event):
         """Update the rectangle while the mouse is being dragged."""
         if self.drawing_rectangle and event.inaxes:
             x0, y0 = self.rect_start
             x1, y1 = event.xdata, event.ydata
-            self.rectangle.set_width(x1 - x0)
-            self.rectangle.set_height(y1 - y0)
-            self.rectangle.set_xy((min(x0, x1), min(y0, y1)))
-            self.canvas.draw()
+            self.view.move_rectangle(x0, y0, x1, y1)  # Blitted, no full redraw
 
     def finalize_rectangle(self, event):
         """Finalize the rectangle when the mouse is released."""
@@ -228,7 +343,12 @@ class DicomViewerPage1(tk.Frame):
             self.rect_end = (event.xdata, event.ydata)
             print(f"Rectangle finalized from {self.rect_start} to {self.rect_end}")
             self.drawing_rectangle = False
+            self.view.end_rectangle()
 
     def go_next(self):
         """Go to the next page (Page 2)."""
-        self.master.show_page_2(self.vol_data, self.rect_start, self.rect_end)
+        if self.load_queue is not None:
+            messagebox.showinfo("Loading", "Please wait until the series has finished loading.")
+            return
+
+        self.master.show_page_2(self.volume or self.vol_data, self.rect_start, self.rect_end)
@@ -3,6 +3,8 @@ import tkinter as tk
 from tkinter import filedialog
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from SliceView import SliceView
+from SliceCache import SliceCache, default_window
 
 
 class DicomViewerPage3(tk.Frame):
@@ -30,6 +32,14 @@ class DicomViewerPage3(tk.Frame):
 
         self.vol_data = my_data
 
+        # One display cache per axis, all with the same window/level
+        window = default_window(my_data)
+        self.caches = [
+            SliceCache(lambda i, level: my_data.plane(0, i, level), window, my_data.dtype),
+            SliceCache(lambda i, level: my_data.plane(1, i, level), window, my_data.dtype),
+            SliceCache(lambda i, level: my_data.plane(2, i, level), window, my_data.dtype)
+        ]
+
         # Configure scrollbars
         for i, scrollbar in enumerate(self.scrollbars):
             scrollbar.config(to=self.vol_data.shape[i] - 1)
@@ -57,6 +67,9 @@ class DicomViewerPage3(tk.Frame):
         # Set the background color for the canvas widget (it may not always work, but it's worth trying)
         self.canvas_widget.config(bg="#323232")
 
+        # One persistent image per axis, updated in place
+        self.views = [SliceView(ax, self.canvas) for ax in self.axes]
+
         # Scrollbar for slice navigation
         self.scrollbars = [
             tk.Scale(self, from_=0, to=0, orient="horizontal",
@@ -114,6 +127,13 @@ class DicomViewerPage3(tk.Frame):
         self.grid_columnconfigure(1, weight=1)
         self.grid_columnconfigure(2, weight=1)
 
+    def destroy(self):
+        """Release the figure (and the slices it holds) before the page goes away."""
+        for cache in self.caches:
+            cache.close()
+        plt.close(self.fig)
+        super().destroy()
+
     def reset_app(self):
         """Calls the reset_app method in MainWindow"""
         self.master.reset_app()
@@ -121,29 +141,27 @@ class DicomViewerPage3(tk.Frame):
     def update_slice(self, index, axis):
         if self.vol_data is not None:
             self.rect_coords[axis] = None  # Clear rectangle for this axis
-            self.update_images()
+            self.update_view(axis)  # Only the view that scrolled changes
+
+    def update_view(self, axis):
+        index = self.scrollbars[axis].get()
+        view = self.views[axis]
+        level = self.vol_data.display_level(view)  # Coarser pyramid level when zoomed out
+        image = self.caches[axis].get(index, 0, self.vol_data.shape[axis], level)
+        view.show(image, clim=(0, 255), extent=self.vol_data.plane_extent(axis))
+
+        if self.rect_coords[axis]:
+            rect = self.rect_coords[axis]
+            view.set_rectangle(rect[0], rect[1], rect[2], rect[3], edgecolor='red', linewidth=1)
+        else:
+            view.clear_rectangle()
 
     def update_images(self):
         if self.vol_data is None:
             return
 
-        slices = [
-            self.vol_data[self.scrollbars[0].get(), :, :],
-            self.vol_data[:, self.scrollbars[1].get(), :],
-            self.vol_data[:, :, self.scrollbars[2].get()]
-        ]
-
-        for i, ax in enumerate(self.axes):
-            ax.clear()
-            ax.imshow(slices[i], cmap='gray')
-            ax.axis('off')
-
-            if self.rect_coords[i]:
-                rect = self.rect_coords[i]
-                ax.add_patch(plt.Rectangle((rect[0], rect[1]), rect[2] - rect[0], rect[3] - rect[1],
-                                           fill=False, color='red'))
-
-        self.canvas.draw()
+        for axis in range(3):
+            self.update_view(axis)
 
     def save_data(self):
         file_path = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV files", "*.csv")])
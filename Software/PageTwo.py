@@ -1,7 +1,8 @@
 import tkinter as tk
 import matplotlib.pyplot as plt
-from matplotlib.patches import Rectangle
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from SliceView import SliceView
+from SliceCache import SliceCache, default_window
 
 
 class DicomViewerPage2(tk.Frame):
@@ -11,7 +12,8 @@ class DicomViewerPage2(tk.Frame):
         self.configure(bg='#323232')
         self.vol_data = vol_data
         self.middle_slice_idx = 0
-        self.rectangle = None
+        self.window = default_window(vol_data)
+        self.cache = None
 
         self.fig, self.ax = plt.subplots(figsize=(7, 6))
         self.fig.patch.set_facecolor('#323232')
@@ -47,6 +49,7 @@ class DicomViewerPage2(tk.Frame):
         # Matplotlib canvas
         self.canvas = FigureCanvasTkAgg(self.fig, master=self.canvas_frame)
         self.canvas.get_tk_widget().pack(side="left", fill="both", expand=True)
+        self.view = SliceView(self.ax, self.canvas)
 
         # Buttons: Previous, Reset, and Next
         button_frame = tk.Frame(self, bg='#323232')
@@ -66,61 +69,61 @@ class DicomViewerPage2(tk.Frame):
 
         # Bind rectangle drawing
         self.drawing_rectangle = False
-        self.rectangle = None
         self.canvas.mpl_connect("button_press_event", self.start_rectangle)
         self.canvas.mpl_connect("motion_notify_event", self.update_rectangle)
         self.canvas.mpl_connect("button_release_event", self.finalize_rectangle)
 
     def init_image(self):
+        vol_data = self.vol_data
+        if self.cache is not None:
+            self.cache.close()
+
+        # One display cache per side, rebuilt when the side changes
         if self.var.get() == 1:
-            self.middle_slice_idx = self.vol_data.shape[1] // 2
-            middle_slice = self.vol_data[:, self.middle_slice_idx, :]
+            self.middle_slice_idx = vol_data.shape[1] // 2
+            self.cache = SliceCache(lambda i, level: vol_data.plane(1, i, level), self.window, vol_data.dtype)
         elif self.var.get() == 2:
-            self.middle_slice_idx = self.vol_data.shape[2] // 2
-            middle_slice = self.vol_data[:, :, self.middle_slice_idx]
+            self.middle_slice_idx = vol_data.shape[2] // 2
+            self.cache = SliceCache(lambda i, level: vol_data.plane(2, i, level), self.window, vol_data.dtype)
 
-        self.ax.clear()
-        self.ax.imshow(middle_slice, cmap="gray")
-        self.ax.set_xticks([])
-        self.ax.set_yticks([])
-        self.canvas.draw()
+        self.update_image()
 
     def update_image(self):
         """Update the displayed image based on the current slice index."""
-        if self.vol_data is not None:
-            if self.var.get() == 1:
-                middle_slice = self.vol_data[:, self.middle_slice_idx, :]
-            elif self.var.get() == 2:
-                middle_slice = self.vol_data[:, :, self.middle_slice_idx]
-
-            self.ax.clear()
-            self.ax.imshow(middle_slice, cmap="gray")
-            self.ax.set_xticks([])  # Remove x-axis ticks
-            self.ax.set_yticks([])  # Remove y-axis ticks
-
-            if self.rectangle:
-                self.ax.add_patch(self.rectangle)
-
-            self.canvas.draw()
+        if self.vol_data is not None and self.cache is not None:
+            axis = self.var.get()
+            level = self.vol_data.display_level(self.view)  # Coarser pyramid level when zoomed out
+            middle_slice = self.cache.get(self.middle_slice_idx, 0, self.vol_data.shape[axis], level)
+            self.view.show(middle_slice, clim=(0, 255), extent=self.vol_data.plane_extent(axis))
 
     def scroll_image(self, *args):
         """Update the slice index and replot the image."""
         if self.vol_data is not None:
+            # Number of slices along the axis of the chosen side
+            count = self.vol_data.shape[self.var.get()]
+
             if args[0] == "moveto":
                 # Adjust index based on scrollbar position
                 fraction = float(args[1])
-                self.middle_slice_idx = int(fraction * (self.vol_data.shape[0] - 1))
+                self.middle_slice_idx = max(0, min(int(fraction * (count - 1)), count - 1))
             elif args[0] == "scroll":
                 # Adjust index based on scroll amount
                 step = int(args[1])
-                self.middle_slice_idx = max(0, min(self.middle_slice_idx + step, self.vol_data.shape[0] - 1))
+                self.middle_slice_idx = max(0, min(self.middle_slice_idx + step, count - 1))
 
             # Update scrollbar position
-            self.scrollbar.set(self.middle_slice_idx / (self.vol_data.shape[0] - 1),
-                               (self.middle_slice_idx + 1) / (self.vol_data.shape[0] - 1))
+            self.scrollbar.set(self.middle_slice_idx / (count - 1),
+                               (self.middle_slice_idx + 1) / (count - 1))
 
             self.update_image()
 
+    def destroy(self):
+        """Release the figure (and the slices it holds) before the page goes away."""
+        if self.cache is not None:
+            self.cache.close()
+        plt.close(self.fig)
+        super().destroy()
+
     def go_previous(self):
         """Go back to Page 1."""
         self.master.show_page_1()
@@ -131,33 +134,26 @@ class DicomViewerPage2(tk.Frame):
 
     def reset_drawing(self):
         """Reset the drawing."""
-        if self.rectangle:
-            self.rectangle.remove()
-            self.rectangle = None
-        self.canvas.draw()
+        self.view.clear_rectangle()
 
     def start_rectangle(self, event):
         """Start drawing a rectangle."""
         if event.inaxes:
             # Check if a rectangle already exists, prevent drawing a new one
-            if self.rectangle is not None:
+            if self.view.rectangle is not None:
                 print("A rectangle already exists. Reset before drawing a new one.")
                 return
 
             self.drawing_rectangle = True  # Set flag to indicate drawing has started
             self.rect_start = (event.xdata, event.ydata)
-            self.rectangle = Rectangle(self.rect_start, 0, 0, edgecolor='red', facecolor='none', linewidth=2)
-            self.ax.add_patch(self.rectangle)
+            self.view.begin_rectangle(*self.rect_start)
 
     def update_rectangle(self, event):
         """Update the rectangle while the mouse is being dragged."""
         if self.drawing_rectangle and event.inaxes:
             x0, y0 = self.rect_start
             x1, y1 = event.xdata, event.ydata
-            self.rectangle.set_width(x1 - x0)
-            self.rectangle.set_height(y1 - y0)
-            self.rectangle.set_xy((min(x0, x1), min(y0, y1)))
-            self.canvas.draw()
+            self.view.move_rectangle(x0, y0, x1, y1)  # Blitted, no full redraw
 
     def finalize_rectangle(self, event):
         """Finalize the rectangle when the mouse is released."""
@@ -165,3 +161,4 @@ class DicomViewerPage2(tk.Frame):
             self.rect_end = (event.xdata, event.ydata)
             print(f"Rectangle finalized from {self.rect_start} to {self.rect_end}")
             self.drawing_rectangle = False
+            self.view.end_rectangle()
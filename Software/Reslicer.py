@@ -0,0 +1,101 @@
+import os
+import sys
+import ctypes
+import threading
+import numpy as np
+
+
+def available_memory():
+    """Physical memory currently available, in bytes (None if it can't be told)."""
+    try:
+        if sys.platform == "win32":
+            class MemoryStatus(ctypes.Structure):
+                _fields_ = [("dwLength", ctypes.c_ulong), ("dwMemoryLoad", ctypes.c_ulong),
+                            ("ullTotalPhys", ctypes.c_ulonglong), ("ullAvailPhys", ctypes.c_ulonglong),
+                            ("ullTotalPageFile", ctypes.c_ulonglong), ("ullAvailPageFile", ctypes.c_ulonglong),
+                            ("ullTotalVirtual", ctypes.c_ulonglong), ("ullAvailVirtual", ctypes.c_ulonglong),
+                            ("ullAvailExtendedVirtual", ctypes.c_ulonglong)]
+
+            status = MemoryStatus()
+            status.dwLength = ctypes.sizeof(MemoryStatus)
+            ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status))
+            return int(status.ullAvailPhys)
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+class Reslicer:
+    """Orthogonal planes of a (z, y, x) volume at the same speed along every axis.
+
+    On a C-ordered volume vol[:, i, :] and vol[:, :, i] are strided gathers
+    that touch every z-plane. The first request for such a plane starts a
+    background build of a contiguous copy of the volume in that orientation
+    ((y, z, x) for coronal, (x, z, y) for sagittal), read slab by slab along
+    z. Until it is ready, and when it would exceed the memory budget, planes
+    are gathered from the volume directly.
+
+    Memory on top of the zero-copy SharedVolume handle: by default at most
+    one layout, i.e. one extra volume size (volume_fraction=1.0), for the
+    first of coronal/sagittal to be viewed, and only if it fits in half of
+    the physical memory available when it is requested (ram_fraction=0.5).
+    Otherwise nothing is added and planes are gathered. budget_bytes, if
+    given, replaces the volume-size part of the rule; the free-memory cap
+    always applies.
+    """
+
+    def __init__(self, vol_data, budget_bytes=None, volume_fraction=1.0, ram_fraction=0.5, block=16):
+        self.vol_data = vol_data
+        self.shape = tuple(vol_data.shape)
+        self.nbytes = int(np.prod(self.shape)) * np.dtype(vol_data.dtype).itemsize
+        self.budget_bytes = budget_bytes if budget_bytes is not None else int(volume_fraction * self.nbytes)
+        self.ram_fraction = ram_fraction
+        self.block = block
+
+        self.layouts = {}
+        self.building = set()
+        self.used_bytes = 0
+        self.lock = threading.Lock()
+
+    def plane(self, axis, index):
+        """2D plane at index along axis (0: axial, 1: coronal, 2: sagittal)."""
+        if axis == 0:
+            return self.vol_data[index, :, :]
+
+        layout = self.layouts.get(axis)
+        if layout is not None:
+            return layout[index]
+
+        self.request(axis)
+        return self.vol_data[:, index, :] if axis == 1 else self.vol_data[:, :, index]
+
+    def request(self, axis):
+        """Start building the contiguous layout for axis, if the budget allows it."""
+        with self.lock:
+            if axis in self.layouts or axis in self.building:
+                return
+            if self.used_bytes + self.nbytes > self.budget_bytes:
+                return
+            # Free memory is checked now, not at load: the other pages may have taken some since
+            available = available_memory()
+            if available is None or self.nbytes > self.ram_fraction * available:
+                return
+            self.used_bytes += self.nbytes
+            self.building.add(axis)
+
+        threading.Thread(target=self.build, args=(axis,), daemon=True).start()
+
+    def build(self, axis):
+        z = self.shape[0]
+        order = (1, 0, 2) if axis == 1 else (2, 0, 1)
+        layout = np.empty(tuple(self.shape[i] for i in order), dtype=self.vol_data.dtype)
+
+        # z-slabs are contiguous in the source (and in memmapped / chunked files)
+        for z0 in range(0, z, self.block):
+            slab = np.asarray(self.vol_data[z0:z0 + self.block, :, :])
+            layout[:, z0:z0 + slab.shape[0], :] = slab.transpose(order)
+
+        layout.flags.writeable = False
+        with self.lock:
+            self.layouts[axis] = layout
+            self.building.discard(axis)
@@ -0,0 +1,66 @@
+import numpy as np
+from Reslicer import Reslicer
+from VolumePyramid import VolumePyramid
+
+
+class SharedVolume:
+    """Read-only (z, y, x) volume handle shared by all viewer pages.
+
+    Wraps an in-memory array, an np.memmap or a lazy ChunkedVolume (see
+    volume_store) without copying it. Slicing returns read-only views, so
+    pages can't change the data behind each other's back; a page that needs
+    to modify voxels asks for its own copy with writable() (copy-on-write).
+    """
+
+    def __init__(self, data):
+        reslicer = pyramid = None
+        if isinstance(data, SharedVolume):
+            data, reslicer, pyramid = data.data, data.reslicer, data.pyramid
+        elif isinstance(data, np.ndarray):
+            # A read-only view, the caller's array (or memmap) stays shared
+            data = data.view()
+            data.flags.writeable = False
+
+        self.data = data
+        self.shape = tuple(data.shape)
+        self.dtype = np.dtype(data.dtype)
+        self.ndim = len(self.shape)
+        self.nbytes = int(np.prod(self.shape)) * self.dtype.itemsize
+
+        # Contiguous coronal/sagittal copies, built on first use and shared by all pages
+        self.reslicer = reslicer or Reslicer(self.data)
+
+        # Downsampled levels for display, built in the background as soon as the volume is shared
+        self.pyramid = pyramid or VolumePyramid(self)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __array__(self, dtype=None, copy=None):
+        array = np.asarray(self.data)
+        return array if dtype is None else array.astype(dtype)
+
+    def plane(self, axis, index, level=0):
+        """2D plane at index along axis (0: axial, 1: coronal, 2: sagittal), equally fast on every axis.
+
+        level > 0 reads the plane from a downsampled pyramid level instead.
+        """
+        if level:
+            return self.pyramid.plane(axis, index, level)
+        return self.reslicer.plane(axis, index)
+
+    def display_level(self, view):
+        """Pyramid level matching what a SliceView shows on screen."""
+        return self.pyramid.level_for(view.data_per_pixel())
+
+    def plane_extent(self, axis):
+        """imshow extent of a plane along axis in full-resolution voxel coordinates."""
+        rows, cols = [size for i, size in enumerate(self.shape) if i != axis]
+        return (-0.5, cols - 0.5, rows - 0.5, -0.5)
+
+    def writable(self):
+        """Private, writable copy of the volume for a page that changes the data."""
+        return np.array(self.data)
@@ -0,0 +1,144 @@
+import threading
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+def default_window(vol_data, samples=16):
+    """(center, width) covering the intensity range of a few evenly spaced z-slices."""
+    step = max(1, vol_data.shape[0] // samples)
+    sample = np.asarray(vol_data[::step])
+    lo, hi = float(sample.min()), float(sample.max())
+    return (lo + hi) / 2, max(hi - lo, 1.0)
+
+
+def window_lut(center, width, dtype):
+    """Lookup table mapping every 8/16-bit value to a display uint8, or None for other dtypes.
+
+    Signed data is indexed with its sign bit flipped (see apply_window), so
+    entry 0 of the table is the most negative value.
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind not in "ui" or dtype.itemsize > 2:
+        return None
+
+    values = np.arange(1 << (8 * dtype.itemsize), dtype=np.float32)
+    if dtype.kind == "i":
+        values -= 1 << (8 * dtype.itemsize - 1)
+
+    lut = (values - (center - width / 2)) * (255.0 / width)
+    return np.clip(lut, 0, 255).astype(np.uint8)
+
+
+def apply_window(slice_data, center, width, lut=None):
+    """Convert a raw slice to uint8 display form, through the LUT when there is one."""
+    if lut is None:
+        display = (np.asarray(slice_data, dtype=np.float32) - (center - width / 2)) * (255.0 / width)
+        return np.clip(display, 0, 255).astype(np.uint8)
+
+    if slice_data.dtype.kind == "i":
+        unsigned = np.dtype(f"u{slice_data.dtype.itemsize}")
+        slice_data = slice_data.view(unsigned) ^ unsigned.type(1 << (8 * unsigned.itemsize - 1))
+
+    return np.take(lut, slice_data)
+
+
+class SliceCache:
+    """LRU cache of display-ready slices of one view, with neighbour prefetch.
+
+    get_slice(index, level) returns the raw 2D slice for an index along the
+    view's axis, read from a pyramid level (see VolumePyramid). Slices are
+    stored after window/level, as uint8, within a fixed memory budget; the
+    slices on either side of the one being shown are prepared on a worker
+    thread so scrolling is mostly cache hits. At level k, 2**k neighbouring
+    indices share one cached slice.
+    """
+
+    def __init__(self, get_slice, window, dtype, budget_bytes=64 * 1024 ** 2, prefetch=3):
+        self.get_slice = get_slice
+        self.dtype = np.dtype(dtype)
+        self.budget_bytes = budget_bytes
+        self.prefetch = prefetch
+
+        self.slices = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.current = None
+        self.generation = 0
+        self.worker = ThreadPoolExecutor(max_workers=1)
+
+        self.set_window(*window)
+
+    def set_window(self, center, width):
+        """Change window/level; cached slices are dropped since they were rendered with the old one."""
+        with self.lock:
+            self.center, self.width = center, width
+            self.lut = window_lut(center, width, self.dtype)
+            self.generation += 1
+            self.slices.clear()
+            self.nbytes = 0
+
+    def render(self, key):
+        level, index = key
+        return apply_window(self.get_slice(index << level, level), self.center, self.width, self.lut)
+
+    def store(self, key, display, generation):
+        with self.lock:
+            # Rendered with a window that has been replaced since
+            if generation != self.generation or key in self.slices:
+                return
+            self.slices[key] = display
+            self.nbytes += display.nbytes
+
+            # Evict least recently used slices, never the one on screen
+            while self.nbytes > self.budget_bytes and len(self.slices) > 1:
+                old_key, old = self.slices.popitem(last=False)
+                if old_key == self.current:
+                    self.slices[old_key] = old
+                    continue
+                self.nbytes -= old.nbytes
+
+    def get(self, index, lo=0, hi=None, level=0):
+        """Display slice at index (from a pyramid level); prefetches neighbours within [lo, hi)."""
+        key = (level, index >> level)
+        self.current = key
+        with self.lock:
+            display = self.slices.get(key)
+            if display is not None:
+                self.slices.move_to_end(key)
+
+        if display is None:
+            generation = self.generation
+            display = self.render(key)
+            self.store(key, display, generation)
+
+        self.prefetch_around(index, lo, hi, level)
+        return display
+
+    def prefetch_around(self, index, lo=0, hi=None, level=0):
+        step = 1 << level
+        for offset in range(step, (self.prefetch + 1) * step, step):
+            for neighbour in (index + offset, index - offset):
+                if neighbour < lo or (hi is not None and neighbour >= hi):
+                    continue
+                key = (level, neighbour >> level)
+                with self.lock:
+                    if key in self.slices or key in self.pending:
+                        continue
+                    self.pending.add(key)
+                self.worker.submit(self.prefetch_one, key)
+
+    def prefetch_one(self, key):
+        try:
+            # The user may have scrolled (or zoomed) away while this was queued
+            current = self.current
+            if current is None or (current[0] == key[0] and abs(key[1] - current[1]) <= self.prefetch):
+                generation = self.generation
+                self.store(key, self.render(key), generation)
+        finally:
+            with self.lock:
+                self.pending.discard(key)
+
+    def close(self):
+        self.worker.shutdown(wait=False, cancel_futures=True)
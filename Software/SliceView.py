@@ -0,0 +1,121 @@
+from matplotlib.patches import Rectangle
+
+
+class SliceView:
+    """Persistent-artist renderer for one slice view (one matplotlib Axes).
+
+    Keeps a single AxesImage and updates it in place with set_data instead of
+    clearing the axes and calling imshow on every scroll step. Full redraws
+    go through canvas.draw_idle, so requests that arrive faster than Tk can
+    paint are merged into one draw. The rubber-band rectangle is animated and
+    blitted over a cached background of the axes, so dragging never triggers
+    a full redraw either.
+    """
+
+    def __init__(self, ax, canvas, cmap="gray"):
+        self.ax = ax
+        self.canvas = canvas
+        self.cmap = cmap
+        self.image = None
+        self.rectangle = None
+        self.background = None
+        self._blit_pending = None
+
+        self.ax.set_xticks([])
+        self.ax.set_yticks([])
+
+        # Every full draw refreshes the background the rectangle is blitted on
+        self.canvas.mpl_connect("draw_event", self.on_draw)
+
+    def show(self, slice_data, clim=None, extent=None):
+        """Display a 2D slice, reusing the image artist when the shape is unchanged.
+
+        extent places a downsampled slice over the full-resolution pixel grid,
+        so mouse coordinates stay in full-resolution voxels.
+        """
+        if clim is None:
+            clim = (slice_data.min(), slice_data.max())
+
+        if self.image is None or self.image.get_array().shape != slice_data.shape:
+            if self.image is not None:
+                self.image.remove()
+            self.image = self.ax.imshow(slice_data, cmap=self.cmap, extent=extent)
+            self.ax.set_xticks([])
+            self.ax.set_yticks([])
+        else:
+            self.image.set_data(slice_data)
+            if extent is not None and tuple(self.image.get_extent()) != tuple(extent):
+                self.image.set_extent(extent)
+
+        self.image.set_clim(*clim)
+        self.canvas.draw_idle()
+
+    def data_per_pixel(self):
+        """Full-resolution voxels per screen pixel in the visible part of the axes."""
+        if self.image is None:
+            return 1.0
+
+        x0, x1 = self.ax.get_xlim()
+        y0, y1 = self.ax.get_ylim()
+        width, height = self.ax.bbox.width, self.ax.bbox.height
+        if width < 1 or height < 1:
+            return 1.0
+
+        return min(abs(x1 - x0) / width, abs(y1 - y0) / height)
+
+    def on_draw(self, event):
+        """Cache the freshly drawn axes and put a rubber-band rectangle back on top."""
+        if self.rectangle is not None and self.rectangle.get_animated():
+            self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+            self.ax.draw_artist(self.rectangle)
+
+    def begin_rectangle(self, x, y, **style):
+        """Start a rubber-band rectangle at (x, y)."""
+        style = dict(dict(edgecolor='red', facecolor='none', linewidth=2), **style)
+        self.rectangle = Rectangle((x, y), 0, 0, animated=True, **style)
+        self.ax.add_patch(self.rectangle)
+
+        # One full draw to capture the background without the rectangle
+        self.canvas.draw()
+
+    def move_rectangle(self, x0, y0, x1, y1):
+        """Resize the rubber-band rectangle; the blit happens at most once per idle cycle."""
+        self.rectangle.set_xy((min(x0, x1), min(y0, y1)))
+        self.rectangle.set_width(abs(x1 - x0))
+        self.rectangle.set_height(abs(y1 - y0))
+
+        if self._blit_pending is None:
+            self._blit_pending = self.canvas.get_tk_widget().after_idle(self.blit_rectangle)
+
+    def blit_rectangle(self):
+        """Restore the cached background and draw only the rectangle on top of it."""
+        self._blit_pending = None
+        if self.rectangle is None or self.background is None:
+            return
+
+        self.canvas.restore_region(self.background)
+        self.ax.draw_artist(self.rectangle)
+        self.canvas.blit(self.ax.bbox)
+
+    def end_rectangle(self):
+        """Freeze the rectangle so it is drawn with the rest of the axes from now on."""
+        if self.rectangle is not None:
+            self.rectangle.set_animated(False)
+            self.background = None
+            self.canvas.draw_idle()
+
+    def set_rectangle(self, x0, y0, x1, y1, **style):
+        """Show a fixed rectangle (replacing any previous one)."""
+        self.clear_rectangle()
+        style = dict(dict(edgecolor='red', facecolor='none', linewidth=2), **style)
+        self.rectangle = Rectangle((min(x0, x1), min(y0, y1)), abs(x1 - x0), abs(y1 - y0), **style)
+        self.ax.add_patch(self.rectangle)
+        self.canvas.draw_idle()
+
+    def clear_rectangle(self):
+        """Remove the rectangle, if any."""
+        if self.rectangle is not None:
+            self.rectangle.remove()
+            self.rectangle = None
+            self.background = None
+            self.canvas.draw_idle()
@@ -0,0 +1,70 @@
+import threading
+import numpy as np
+
+
+def downsample2(vol_data, block=16):
+    """Halve a (z, y, x) volume along every axis by averaging 2x2x2 blocks.
+
+    Reads the source in z-slabs, so memmapped and chunked volumes are
+    streamed rather than loaded whole. Odd trailing planes are dropped.
+    """
+    z, y, x = (size // 2 for size in vol_data.shape)
+    out = np.empty((z, y, x), dtype=vol_data.dtype)
+
+    for z0 in range(0, z, block):
+        z1 = min(z0 + block, z)
+        slab = np.asarray(vol_data[2 * z0:2 * z1, :2 * y, :2 * x], dtype=np.float32)
+        slab = slab.reshape(z1 - z0, 2, y, 2, x, 2).mean(axis=(1, 3, 5))
+        if out.dtype.kind in "ui":
+            slab = np.rint(slab)
+        out[z0:z1] = slab
+
+    return out
+
+
+class VolumePyramid:
+    """Downsampled copies (2x, 4x, ...) of a volume for interactive display.
+
+    Level 0 is the volume itself; level k is 2**k times smaller along every
+    axis. Levels are built on a background thread when the pyramid is
+    created, and until a level is ready the next finer one is used. A view
+    picks the coarsest level that still has at least one voxel per screen
+    pixel, so zooming in (or a view larger than the data) falls back to full
+    resolution. Coordinates always stay in full-resolution voxels.
+    """
+
+    def __init__(self, base, max_levels=3, min_size=64):
+        self.base = base
+        self.levels = []
+        self.max_levels = max_levels
+        self.min_size = min_size
+
+        threading.Thread(target=self.build, daemon=True).start()
+
+    def build(self):
+        source = self.base.data
+        for _ in range(self.max_levels):
+            if min(source.shape) // 2 < self.min_size:
+                break
+            source = downsample2(source)
+            self.levels.append(source)
+
+    def level_for(self, data_per_pixel):
+        """Coarsest built level with no more than data_per_pixel voxels per screen pixel."""
+        level = 0
+        while level < len(self.levels) and 2 ** (level + 1) <= data_per_pixel:
+            level += 1
+        return level
+
+    def plane(self, axis, index, level=0):
+        """Plane through full-resolution index along axis, taken from the given level."""
+        if level == 0 or level > len(self.levels):
+            return self.base.plane(axis, index)
+
+        vol_data = self.levels[level - 1]
+        index = min(index >> level, vol_data.shape[axis] - 1)
+        if axis == 0:
+            return vol_data[index, :, :]
+        elif axis == 1:
+            return vol_data[:, index, :]
+        return vol_data[:, :, index]
@@ -1,7 +1,14 @@
+import os
+import sys
 import tkinter as tk
+
+# Shared modules (dicom_series, volume_store, ...) live in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 from PageOne import DicomViewerPage1
 from PageTwo import DicomViewerPage2
 from PageThree import DicomViewerPage3
+from SharedVolume import SharedVolume
 
 
 class MainWindow(tk.Tk):
@@ -29,8 +36,9 @@ class MainWindow(tk.Tk):
 
         self.start_rect_1, self.end_rect_1 = start_rect_1, end_rect_1
 
-        self.arch_data = vol_data.copy()
-        self.current_page = DicomViewerPage2(self, vol_data)
+        # Pages 2 and 3 share one read-only handle instead of each holding a copy
+        self.arch_data = SharedVolume(vol_data)
+        self.current_page = DicomViewerPage2(self, self.arch_data)
         self.current_page.pack(fill="both", expand=True)
 
     def show_page_3(self, start_rect_2, end_rect_2):
@@ -0,0 +1,371 @@
+import os
+import numpy as np
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from scipy.ndimage import rotate, gaussian_filter, map_coordinates, zoom
+from skimage.exposure import equalize_adapthist
+
+from shard_store import ShardWriter
+
+
+def constant_planes(samples, axis, tol=1e-3):
+    """Which planes along axis are constant, for a batch of (n, D, H, W) samples.
+
+    A plane counts as constant when every voxel is within tol (plus the
+    usual 1e-5 relative tolerance of np.allclose) of its first voxel.
+    Returns an (n, size) bool array.
+    """
+    others = tuple(other for other in (1, 2, 3) if other != axis)
+
+    # First voxel of every plane
+    first = [slice(None)] * 4
+    for other in others:
+        first[other] = 0
+    reference = samples[tuple(first)]
+
+    # Every voxel is close to the first one iff the plane's extremes are,
+    # so two reductions replace a full-size comparison
+    limit = tol + 1e-5 * np.abs(reference)
+    return (samples.max(axis=others) - reference <= limit) & (reference - samples.min(axis=others) <= limit)
+
+
+def padding_extents(samples, tol=1e-3):
+    """Per sample and axis, the [start, end) range left after dropping constant border planes.
+
+    samples is (n, D, H, W); returns an (n, 3, 2) int array. A sample made
+    only of constant planes along an axis gets start = size and end = 0.
+    """
+    extents = np.empty((samples.shape[0], 3, 2), dtype=np.int64)
+    for axis in (1, 2, 3):
+        constant = constant_planes(samples, axis, tol)
+        size = constant.shape[1]
+        all_constant = constant.all(axis=1)
+
+        # First non-constant plane from either side
+        leading = np.where(all_constant, size, np.argmin(constant, axis=1))
+        trailing = np.where(all_constant, size, np.argmin(constant[:, ::-1], axis=1))
+
+        extents[:, axis - 1, 0] = leading
+        extents[:, axis - 1, 1] = size - trailing
+
+    return extents
+
+
+def remove_padding_borders(x, tol=1e-3, chunk_size=32, inplace=True):
+    """Zero the constant border planes of every sample in a batch.
+
+    x is (N, D, H, W) or (N, D, H, W, C); with channels, borders are found
+    on and zeroed in channel 0. Samples are processed chunk_size at a time,
+    so temporary memory stays a few chunks whatever the dataset size. The
+    batch is changed in place unless inplace=False.
+    """
+    if not inplace:
+        x = np.copy(x)
+
+    volumes = x[..., 0] if x.ndim == 5 else x
+    for start in range(0, volumes.shape[0], chunk_size):
+        samples = volumes[start:start + chunk_size]
+        extents = padding_extents(samples, tol)
+
+        # Keep mask per axis, broadcast to the whole chunk when zeroing
+        keep = [(np.arange(size) >= extents[:, axis, :1]) & (np.arange(size) < extents[:, axis, 1:])
+                for axis, size in enumerate(samples.shape[1:])]
+        keep = keep[0][:, :, None, None] & keep[1][:, None, :, None] & keep[2][:, None, None, :]
+        np.copyto(samples, 0, where=~keep)
+
+    return x
+
+
+def threshold_background(x, threshold=0.3):
+    """Zero every voxel with |value| < threshold, in place (x is returned)."""
+    np.copyto(x, 0, where=np.abs(x) < threshold)
+    return x
+
+
+def local_contrast_enhancement(data, clip_limit=0.03):
+    """3D CLAHE (skimage equalize_adapthist)."""
+    return equalize_adapthist(data, clip_limit=clip_limit)
+
+
+def enhance_volume(volume, threshold=0.3, clip_limit=0.03):
+    """Background threshold, CLAHE and min-max normalization of one (D, H, W) volume, as float32."""
+    volume = threshold_background(np.array(volume, dtype=np.float32), threshold)
+    enhanced = local_contrast_enhancement(volume, clip_limit).astype(np.float32, copy=False)
+    return normalize(enhanced)
+
+
+def _enhance_chunk(chunk, threshold, clip_limit):
+    return np.stack([enhance_volume(volume, threshold, clip_limit) for volume in chunk])
+
+
+def enhance_dataset(x, y, path, depth=(20, 120), threshold=0.3, clip_limit=0.03, workers=None, chunk_size=4):
+    """Enhance every sample of x into a sharded dataset at path, chunk_size samples per task of a process pool.
+
+    x is (N, D, H, W) or (N, D, H, W, 1); each sample is cut to the depth
+    range [start, end), thresholded, equalized and normalized (see
+    enhance_volume) and stored channel-first, as (1, d, H, W) float32 under
+    key "<index>", so training reads it straight from the shards.
+    Samples already in the dataset are skipped, so a rerun only does what is
+    missing. The parameters are recorded with the dataset; resuming it with
+    different ones raises ValueError. Returns the number of samples made.
+    """
+    volumes = x[..., 0] if x.ndim == 5 else x
+    attrs = {"depth": list(depth), "threshold": threshold, "clip_limit": clip_limit, "channels_first": True}
+    workers = workers or os.cpu_count()
+
+    with ShardWriter(path, attrs=attrs) as writer:
+        todo = [i for i in range(len(volumes)) if f"{i}" not in writer]
+        chunks = [todo[start:start + chunk_size] for start in range(0, len(todo), chunk_size)]
+
+        def write(chunk, future):
+            for i, enhanced in zip(chunk, future.result()):
+                writer.append(f"{i}", enhanced[np.newaxis], int(y[i]))
+
+        # A bounded number of chunks in flight keeps memory flat; results are written in index order
+        pending = deque()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for chunk in chunks:
+                samples = volumes[chunk, depth[0]:depth[1]]
+                pending.append((chunk, pool.submit(_enhance_chunk, samples, threshold, clip_limit)))
+                if len(pending) >= 2 * workers:
+                    write(*pending.popleft())
+            while pending:
+                write(*pending.popleft())
+
+    return len(todo)
+
+
+def elastic_deformation(data, rng=None, alpha=15, sigma=3):
+    """Smooth random displacement of every voxel (up to about alpha voxels)."""
+    rng = rng or np.random.default_rng()
+    shape = data.shape
+    dx = gaussian_filter(rng.standard_normal(shape), sigma) * alpha
+    dy = gaussian_filter(rng.standard_normal(shape), sigma) * alpha
+    dz = gaussian_filter(rng.standard_normal(shape), sigma) * alpha
+    x, y, z = np.meshgrid(np.arange(shape[0]), np.arange(shape[1]), np.arange(shape[2]), indexing='ij')
+    indices = (x + dx, y + dy, z + dz)
+    return map_coordinates(data, indices, order=1, mode='reflect')
+
+
+def random_rotation(data, rng=None, max_angle=10):
+    """Rotation by up to max_angle degrees in a random plane."""
+    rng = rng or np.random.default_rng()
+    angle = rng.uniform(-max_angle, max_angle)
+    axes = [(0, 1), (0, 2), (1, 2)][rng.integers(3)]
+    return rotate(data, angle, axes=axes, reshape=False, mode='nearest')
+
+
+def random_flip(data, rng=None):
+    """Flip along each axis with probability 1/2."""
+    rng = rng or np.random.default_rng()
+    if rng.random() > 0.5:
+        data = np.flip(data, axis=0)
+    if rng.random() > 0.5:
+        data = np.flip(data, axis=1)
+    if rng.random() > 0.5:
+        data = np.flip(data, axis=2)
+    return data
+
+
+def add_noise(data, rng=None, min_scale=0.05, max_scale=0.15):
+    """Gaussian noise with a random standard deviation."""
+    rng = rng or np.random.default_rng()
+    scale = rng.uniform(min_scale, max_scale)
+    noise = rng.normal(loc=0.0, scale=scale, size=data.shape)
+    return data + noise
+
+
+def random_zoom(data, rng=None, zoom_range=(1.1, 1.5)):
+    """Zoom in by a random factor, center-cropped back to the original shape."""
+    rng = rng or np.random.default_rng()
+    zoom_factor = rng.uniform(*zoom_range)
+    zoomed = zoom(data, zoom_factor, order=1, mode='nearest')
+
+    original_shape = data.shape
+    zoomed_shape = zoomed.shape
+    crop_slices = tuple(
+        slice((z - o) // 2, (z - o) // 2 + o) if z > o else slice(0, o)
+        for o, z in zip(original_shape, zoomed_shape)
+    )
+    return zoomed[crop_slices]
+
+
+AUGMENTATIONS = (random_rotation, random_flip, add_noise, random_zoom, elastic_deformation)
+
+
+def normalize(data):
+    """Min-max scale to [0, 1]."""
+    return (data - np.min(data)) / (np.max(data) - np.min(data))
+
+
+def random_augmentation(data, rng=None):
+    """One training view of a volume, drawn like the old pre-augmented set.
+
+    The augmentations are shuffled and split into a set of three and a set
+    of two; the volume comes back unchanged, through the first set or
+    through the second, with equal probability. The chosen set is applied
+    as one fused resampling. The result is min-max normalized float32.
+    """
+    rng = rng or np.random.default_rng()
+    augmentations = [AUGMENTATIONS[i] for i in rng.permutation(len(AUGMENTATIONS))]
+    chosen = [[], augmentations[:3], augmentations[3:]][rng.integers(3)]
+
+    # One resampling for the whole chain (see FusedAugmentation)
+    data = FusedAugmentation(data.shape, rng).compose(chosen).apply(data)
+
+    return normalize(data).astype(np.float32)
+
+
+def smoothed_noise_std(sigma, ndim=3):
+    """Standard deviation of white noise after gaussian_filter(sigma), from the discrete kernel."""
+    radius = int(4.0 * sigma + 0.5)
+    kernel = np.exp(-0.5 * (np.arange(-radius, radius + 1) / sigma) ** 2)
+    kernel /= kernel.sum()
+    return float(np.sqrt((kernel ** 2).sum())) ** ndim
+
+
+def upsample_linear(array, shape):
+    """Corner-aligned linear resampling of a float32 array to shape, one axis at a time."""
+    for axis, size in enumerate(shape):
+        n = array.shape[axis]
+        coords = np.arange(size, dtype=np.float32) * np.float32((n - 1) / max(size - 1, 1))
+        lo = np.minimum(coords.astype(np.intp), n - 1)
+        hi = np.minimum(lo + 1, n - 1)
+        weight = (coords - lo).reshape([-1 if i == axis else 1 for i in range(array.ndim)])
+
+        low = np.take(array, lo, axis=axis)
+        array = low + (np.take(array, hi, axis=axis) - low) * weight
+    return array
+
+
+def elastic_field(shape, rng, alpha=15, sigma=3):
+    """Displacement field of elastic_deformation, (3, *shape) float32, made at low resolution.
+
+    The noise is drawn and smoothed on a grid sigma times coarser, scaled to
+    the amplitude the full-resolution field would have, and upsampled
+    linearly. The field is smooth on the scale of sigma, so little is lost.
+    """
+    step = max(int(sigma), 1)
+    low_shape = tuple(-(-size // step) + 1 for size in shape)
+    scale = alpha * smoothed_noise_std(sigma) / smoothed_noise_std(sigma / step)
+
+    field = np.empty((3,) + tuple(shape), dtype=np.float32)
+    for axis in range(3):
+        low = gaussian_filter(rng.standard_normal(low_shape, dtype=np.float32), sigma / step) * np.float32(scale)
+        field[axis] = upsample_linear(low, shape)
+    return field
+
+
+class FusedAugmentation:
+    """Geometric augmentations of one volume composed into a single resampling.
+
+    Rotation, flip and zoom are affine maps from output to input
+    coordinates, so any chain of them collapses into one 3x4 matrix. The
+    elastic displacement is added on top and carried through the linear
+    part of the transforms applied before it. The volume is then
+    interpolated once with map_coordinates on float32 coordinates, instead
+    of once per transform on float64 meshgrids. Noise is added after the
+    resampling. Random parameters are drawn in chain order, with the same
+    distributions as the separate functions.
+    """
+
+    def __init__(self, shape, rng):
+        self.shape = tuple(shape)
+        self.rng = rng
+        self.center = (np.array(self.shape, dtype=np.float64) - 1) / 2
+
+        # Input coordinate = matrix @ output coordinate + offset (+ displacement)
+        self.matrix = np.eye(3)
+        self.offset = np.zeros(3)
+        self.displacement = None
+        self.noise_scale = 0.0
+
+    def _then(self, matrix, offset):
+        # Prepend a transform that is applied to the data before the current chain
+        self.offset = matrix @ self.offset + offset
+        self.matrix = matrix @ self.matrix
+        if self.displacement is not None:
+            self.displacement = np.tensordot(matrix.astype(np.float32), self.displacement, axes=1)
+
+    def rotation(self, max_angle=10):
+        angle = np.deg2rad(self.rng.uniform(-max_angle, max_angle))
+        axes = [(0, 1), (0, 2), (1, 2)][self.rng.integers(3)]
+        # Same convention as scipy.ndimage.rotate(reshape=False)
+        c, s = np.cos(angle), np.sin(angle)
+        matrix = np.eye(3)
+        matrix[np.ix_(axes, axes)] = [[c, s], [-s, c]]
+        return matrix, self.center - matrix @ self.center
+
+    def flip(self):
+        matrix, offset = np.eye(3), np.zeros(3)
+        for axis in range(3):
+            if self.rng.random() > 0.5:
+                matrix[axis, axis] = -1
+                offset[axis] = self.shape[axis] - 1
+        return matrix, offset
+
+    def zoom(self, zoom_range=(1.1, 1.5)):
+        zoom_factor = self.rng.uniform(*zoom_range)
+        # Same grid and center crop as random_zoom
+        zoomed = np.array([round(size * zoom_factor) for size in self.shape], dtype=np.float64)
+        size = np.array(self.shape, dtype=np.float64)
+        start = np.where(zoomed > size, (zoomed - size) // 2, 0)
+        scale = (size - 1) / np.maximum(zoomed - 1, 1)
+        return np.diag(scale), start * scale
+
+    def compose(self, augmentations):
+        """Fold a chain of augmentation functions (applied in list order) into this transform."""
+        geometric = {random_rotation: self.rotation, random_flip: self.flip, random_zoom: self.zoom}
+
+        # Parameters are drawn in chain order, the coordinate map is built from the last transform back
+        steps = []
+        for augment in augmentations:
+            if augment is add_noise:
+                self.noise_scale = self.rng.uniform(0.05, 0.15)
+            elif augment is elastic_deformation:
+                steps.append(None)
+            else:
+                steps.append(geometric[augment]())
+
+        for step in reversed(steps):
+            if step is None:
+                field = elastic_field(self.shape, self.rng)
+                self.displacement = field if self.displacement is None else self.displacement + field
+            else:
+                self._then(*step)
+        return self
+
+    def coordinates(self):
+        grids = [np.arange(size, dtype=np.float32) for size in self.shape]
+        coords = np.empty((3,) + self.shape, dtype=np.float32)
+        for axis in range(3):
+            m = self.matrix[axis].astype(np.float32)
+            coords[axis] = (m[0] * grids[0][:, None, None] + m[1] * grids[1][None, :, None]
+                            + m[2] * grids[2][None, None, :] + np.float32(self.offset[axis]))
+        if self.displacement is not None:
+            coords += self.displacement
+        return coords
+
+    def flipped_axes(self):
+        """Axes to flip if the chain is only flips (possibly none), else None."""
+        if self.displacement is not None:
+            return None
+        signs = np.diag(self.matrix)
+        flips = tuple(int(axis) for axis in np.flatnonzero(signs < 0))
+        expected = np.where(signs < 0, np.array(self.shape) - 1, 0)
+        if np.array_equal(self.matrix, np.diag(signs)) and np.all(np.abs(signs) == 1) and np.array_equal(self.offset, expected):
+            return flips
+        return None
+
+    def apply(self, data):
+        data = np.asarray(data, dtype=np.float32)
+        flips = self.flipped_axes()
+        if flips is not None:
+            # Flips (or nothing) only: no interpolation needed
+            out = np.array(np.flip(data, flips))
+        else:
+            out = map_coordinates(data, self.coordinates(), order=1, mode='nearest', output=np.float32)
+
+        if self.noise_scale:
+            out += self.rng.standard_normal(out.shape, dtype=np.float32) * np.float32(self.noise_scale)
+        return out
@@ -0,0 +1,57 @@
+import torch
+import numpy as np
+from torch.utils.data import Dataset, get_worker_info
+
+
+class VolumeDataset(Dataset):
+    """Torch dataset of (1, D, H, W) volumes and (1,) float labels, read lazily.
+
+    source is anything indexable that returns (volume, label), such as a
+    shard_store.ShardReader. Volumes are (D, H, W) or channel-first
+    (1, D, H, W). Without a transform, channel-first float32 volumes are
+    wrapped as they are with torch.from_numpy: a sample read from a
+    memory-mapped shard goes into the batch without an intermediate copy,
+    and nothing is loaded before the first batch.
+
+    transform(volume, rng) gets the (D, H, W) volume and is applied per
+    item, so augmentations run inside the DataLoader workers and every
+    epoch sees new ones.
+
+    Each worker draws from its own generator seeded with the seed torch
+    gives that worker, which the DataLoader derives from the main process
+    seed. Runs are therefore reproducible after torch.manual_seed, the
+    workers don't repeat each other, and new workers (a new epoch without
+    persistent_workers) get new seeds.
+    """
+
+    def __init__(self, source, transform=None):
+        self.source = source
+        self.transform = transform
+        self.rng = None
+        self.rng_seed = None
+
+    def __len__(self):
+        return len(self.source)
+
+    def generator(self):
+        worker = get_worker_info()
+        seed = worker.seed if worker is not None else torch.initial_seed()
+        if seed != self.rng_seed:
+            self.rng, self.rng_seed = np.random.default_rng(seed), seed
+        return self.rng
+
+    def __getitem__(self, i):
+        volume, label = self.source[i]
+        volume = np.asarray(volume)
+        label = torch.tensor([label], dtype=torch.float32)
+
+        if self.transform is None and volume.ndim == 4:
+            return torch.from_numpy(np.ascontiguousarray(volume, dtype=np.float32)), label
+
+        if volume.ndim == 4:
+            volume = volume[0]
+        if self.transform is not None:
+            volume = self.transform(volume, self.generator())
+
+        volume = torch.from_numpy(np.ascontiguousarray(volume, dtype=np.float32)).unsqueeze(0)
+        return volume, label
@@ -0,0 +1,273 @@
+import os
+import json
+import pydicom
+import numpy as np
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+# The index lives inside the study folder and is ignored when computing its key
+INDEX_FILE = ".series_index.json"
+INDEX_VERSION = 1
+
+
+def folder_key(dicom_folder):
+    """Cheap fingerprint of a study folder: file count, total size and latest mtime."""
+    count, size, mtime = 0, 0, 0
+    with os.scandir(dicom_folder) as entries:
+        for entry in entries:
+            if entry.name == INDEX_FILE or not entry.is_file():
+                continue
+            stat = entry.stat()
+            count += 1
+            size += stat.st_size
+            mtime = max(mtime, stat.st_mtime_ns)
+
+    return {"count": count, "size": size, "mtime": mtime}
+
+
+def pixel_dtype(dcom_data):
+    """dtype of the pixel array pydicom would decode for this header."""
+    kind = "i" if int(dcom_data.get("PixelRepresentation", 0)) == 1 else "u"
+    return np.dtype(f"<{kind}{int(dcom_data.BitsAllocated) // 8}").str
+
+
+def pixel_data_offset(fp, dcom_data, shape, dtype):
+    """Offset of the raw pixel values in the file, or None if they can't be read directly.
+
+    fp must be positioned at the PixelData tag, which is where dcmread stops
+    with stop_before_pixels=True.
+    """
+    transfer_syntax = dcom_data.file_meta.get("TransferSyntaxUID")
+    if transfer_syntax is None or transfer_syntax.is_encapsulated or not transfer_syntax.is_little_endian:
+        return None
+    # Signed data with unused high bits needs pydicom's sign correction
+    if dtype[1] == "i" and int(dcom_data.BitsStored) != int(dcom_data.BitsAllocated):
+        return None
+
+    tag_offset = fp.tell()
+    element = fp.read(12)
+    if element[:4] != b"\xe0\x7f\x10\x00":
+        return None
+
+    if transfer_syntax.is_implicit_VR:
+        length, value_offset = int.from_bytes(element[4:8], "little"), tag_offset + 8
+    elif element[4:6] in (b"OB", b"OW", b"OD", b"OF", b"OL", b"UN"):
+        length, value_offset = int.from_bytes(element[8:12], "little"), tag_offset + 12
+    else:
+        length, value_offset = int.from_bytes(element[6:8], "little"), tag_offset + 8
+
+    if length < shape[0] * shape[1] * np.dtype(dtype).itemsize:
+        return None
+
+    return value_offset
+
+
+def read_slice_header(file_path):
+    """Read the header of a DICOM file without touching its pixel data.
+
+    Returns an index entry (instance number, frame shape, dtype, spacing and
+    pixel data offset) for single-frame grayscale slices and None for
+    everything else (multi-frame, RGB, non-image or unreadable files).
+    """
+    try:
+        with open(file_path, "rb") as fp:
+            dcom_data = pydicom.dcmread(fp, stop_before_pixels=True)
+
+            if "Rows" not in dcom_data or "InstanceNumber" not in dcom_data:
+                return None
+            if int(dcom_data.get("NumberOfFrames", 1) or 1) != 1:
+                return None
+            if int(dcom_data.get("SamplesPerPixel", 1)) != 1:
+                return None
+
+            shape = [int(dcom_data.Rows), int(dcom_data.Columns)]
+            dtype = pixel_dtype(dcom_data)
+            offset = pixel_data_offset(fp, dcom_data, shape, dtype)
+    except Exception:
+        return None
+
+    # (z, y, x) spacing in mm, None where the header doesn't say
+    pixel_spacing = dcom_data.get("PixelSpacing") or [None, None]
+    slice_thickness = dcom_data.get("SliceThickness")
+    spacing = [float(s) if s is not None else None for s in [slice_thickness] + list(pixel_spacing)]
+
+    return {"file": os.path.basename(file_path),
+            "instance_number": int(dcom_data.InstanceNumber),
+            "shape": shape,
+            "dtype": dtype,
+            "bits_stored": int(dcom_data.get("BitsStored", dcom_data.BitsAllocated)),
+            "spacing": spacing,
+            "offset": offset}
+
+
+def load_index(dicom_folder):
+    """Return the cached index of a study folder, or None if it is missing or stale."""
+    try:
+        with open(os.path.join(dicom_folder, INDEX_FILE)) as file:
+            index = json.load(file)
+    except (OSError, ValueError):
+        return None
+
+    if index.get("version") != INDEX_VERSION or index.get("key") != folder_key(dicom_folder):
+        return None
+
+    return index
+
+
+def save_index(dicom_folder, index):
+    """Write the index next to the slices; read-only studies (CD, network share) are skipped."""
+    index_path = os.path.join(dicom_folder, INDEX_FILE)
+    try:
+        with open(index_path + ".tmp", "w") as file:
+            json.dump(index, file)
+        os.replace(index_path + ".tmp", index_path)
+    except OSError:
+        pass
+
+
+def index_series(dicom_folder, workers=None, use_cache=True):
+    """Header-only index of a series folder, ordered by InstanceNumber.
+
+    The index is cached in the folder and reused as long as the folder's
+    file count, size and mtime are unchanged.
+    """
+    if use_cache:
+        index = load_index(dicom_folder)
+        if index is not None:
+            return index
+
+    key = folder_key(dicom_folder)
+    paths = [os.path.join(dicom_folder, file) for file in sorted(os.listdir(dicom_folder)) if file != INDEX_FILE]
+    paths = [path for path in paths if os.path.isfile(path)]
+
+    # Header reads are I/O bound, threads are enough here
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        slices = [entry for entry in pool.map(read_slice_header, paths) if entry is not None]
+
+    slices = sorted(slices, key=lambda x: x["instance_number"])
+    index = {"version": INDEX_VERSION, "key": key, "slices": slices}
+
+    if use_cache:
+        save_index(dicom_folder, index)
+
+    return index
+
+
+def series_shape(index):
+    """(z, y, x) shape of the volume described by an index, without decoding anything."""
+    slices = index["slices"]
+    if not slices:
+        return (0, 0, 0)
+
+    shapes = {tuple(entry["shape"]) for entry in slices}
+    if len(shapes) != 1:
+        raise ValueError(f"Series mixes slice shapes {sorted(shapes)}")
+
+    return (len(slices),) + shapes.pop()
+
+
+def series_spacing(index):
+    """(z, y, x) spacing in mm taken from the first slice of an index."""
+    return tuple(index["slices"][0]["spacing"]) if index["slices"] else (None, None, None)
+
+
+def read_slice(file_path):
+    """Decode the pixel data of a single DICOM slice (exactly once)."""
+    return pydicom.dcmread(file_path).pixel_array
+
+
+def read_indexed_slice(dicom_folder, entry):
+    """Read one indexed slice, straight from its pixel data offset when it is stored raw."""
+    file_path = os.path.join(dicom_folder, entry["file"])
+    if entry["offset"] is None:
+        return read_slice(file_path)
+
+    shape = tuple(entry["shape"])
+    pixels = np.fromfile(file_path, dtype=entry["dtype"], count=shape[0] * shape[1], offset=entry["offset"])
+    pixels = pixels.reshape(shape)
+
+    # Match pydicom, which masks the unused high bits of unsigned data
+    bits_allocated = pixels.dtype.itemsize * 8
+    if entry["bits_stored"] < bits_allocated:
+        pixels &= (1 << entry["bits_stored"]) - 1
+
+    return pixels
+
+
+def middle_out_order(n):
+    """Slice order starting at the middle of the series and growing outwards on both sides."""
+    if n == 0:
+        return []
+
+    mid = n // 2
+    order = [mid]
+    for step in range(1, n):
+        if mid + step < n:
+            order.append(mid + step)
+        if mid - step >= 0:
+            order.append(mid - step)
+
+    return order
+
+
+def stream_series(dicom_folder, vol_data, index, workers=None, cancel=None):
+    """Decode slices into a preallocated vol_data middle-out, yielding each z once it is stored.
+
+    The loaded slices always form one contiguous range around the middle.
+    cancel is an optional threading.Event; setting it stops the decoding
+    and ends the stream early.
+    """
+    slices = index["slices"]
+
+    def decode_into(z):
+        if cancel is not None and cancel.is_set():
+            return None
+        vol_data[z] = read_indexed_slice(dicom_folder, slices[z])
+        return z
+
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for z in pool.map(decode_into, middle_out_order(len(slices))):
+            if z is None:
+                break
+            yield z
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def load_series(dicom_folder, workers=None, use_processes=False, z_range=None, index=None):
+    """Load a folder of DICOM slices into a (z, y, x) volume.
+
+    Slices are ordered by the (cached) header index, then decoded in parallel,
+    each file once, straight into a preallocated volume. z_range=(start, stop)
+    loads only that part of the series.
+    Set use_processes=True for codecs that hold the GIL (e.g. pure-Python
+    JPEG decoders); the default thread pool avoids pickling every slice.
+    """
+    if index is None:
+        index = index_series(dicom_folder, workers=workers)
+
+    slices = index["slices"]
+    if not slices:
+        raise ValueError(f"No single-frame DICOM slices found in {dicom_folder}")
+
+    _, rows, cols = series_shape(index)
+    if z_range is not None:
+        slices = slices[z_range[0]:z_range[1]]
+
+    vol_data = np.empty((len(slices), rows, cols), dtype=slices[0]["dtype"] if slices else np.uint16)
+
+    def decode_into(z):
+        vol_data[z] = read_indexed_slice(dicom_folder, slices[z])
+
+    if use_processes:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for z, pixels in enumerate(pool.map(partial(read_indexed_slice, dicom_folder), slices, chunksize=8)):
+                vol_data[z] = pixels
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # list() re-raises the first decoding error, if any
+            list(pool.map(decode_into, range(len(slices))))
+
+    return vol_data
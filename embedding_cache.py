@@ -0,0 +1,71 @@
+import os
+import hashlib
+import numpy as np
+import torch
+import torch.nn.functional as F
+from shard_store import ShardWriter, ShardReader
+
+
+def sample_hash(sample):
+    """Content hash of one sample (shape, dtype and data)."""
+    sample = np.ascontiguousarray(sample)
+    digest = hashlib.sha1(f"{sample.shape}{sample.dtype.str}".encode())
+    digest.update(sample.data)
+    return digest.hexdigest()
+
+
+def state_dict_hash(module):
+    """Content hash of a module's weights and buffers, the same with or without a DataParallel wrapper."""
+    digest = hashlib.sha1()
+    for name, tensor in sorted(module.state_dict().items()):
+        name = name[len("module."):] if name.startswith("module.") else name
+        digest.update(name.encode() + b"\0" + tensor.detach().cpu().contiguous().numpy().tobytes())
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    """Pooled embeddings of a frozen encoder, computed once per sample and kept on disk.
+
+    Embeddings live in a sharded dataset (see shard_store) under
+    root/<hash of the encoder weights>, keyed by the hash of each sample,
+    so changing the checkpoint starts a new cache and changing a sample
+    recomputes only that sample. The encoder runs in eval mode (batch norm
+    on its running statistics); a feature map it returns is average-pooled
+    to one vector per sample, pooled encoders (global_pool) are used as
+    they are.
+    """
+
+    def __init__(self, root, encoder):
+        self.encoder = encoder
+        self.checkpoint = state_dict_hash(encoder)
+        self.path = os.path.join(root, self.checkpoint)
+
+    @torch.no_grad()
+    def embed(self, source, batch_size=8, device=None):
+        """Embeddings (N, C) float32 and labels (N,) of every sample of source, computing only the missing ones.
+
+        source is indexable and returns (sample, label) with channel-first
+        (1, D, H, W) samples, such as a shard_store.ShardReader.
+        """
+        device = device or next(self.encoder.parameters()).device
+        keys, labels = [], np.empty(len(source), dtype=np.int32)
+        for i in range(len(source)):
+            sample, labels[i] = source[i]
+            keys.append(sample_hash(sample))
+
+        with ShardWriter(self.path, samples_per_shard=4096, attrs={"checkpoint": self.checkpoint}) as writer:
+            missing = [i for i, key in enumerate(keys) if key not in writer]
+            self.encoder.eval()
+            for start in range(0, len(missing), batch_size):
+                batch = missing[start:start + batch_size]
+                x = torch.from_numpy(np.stack([np.asarray(source[i][0], dtype=np.float32) for i in batch]))
+                features = self.encoder(x.to(device))
+                if features.dim() > 2:
+                    features = F.adaptive_avg_pool3d(features, 1).flatten(1)
+                for i, embedding in zip(batch, features.cpu().numpy()):
+                    writer.append(keys[i], embedding, labels[i])
+
+        reader = ShardReader(self.path)
+        position = {key: i for i, key in enumerate(reader.keys)}
+        embeddings, _ = reader.arrays([position[key] for key in keys])
+        return embeddings, labels
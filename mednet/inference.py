@@ -0,0 +1,158 @@
+import time
+import numpy as np
+import torch
+from torch import nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval, fuse_linear_bn_eval
+from models import resnet
+from model import load_checkpoint
+
+
+def classifier_head(in_features, output_dim=1):
+    """MLP head of the VRF classifier, on top of a pooled encoder."""
+    return nn.Sequential(
+        nn.Flatten(),
+        nn.Linear(in_features, 512),
+        nn.BatchNorm1d(512),
+        nn.ReLU(),
+        nn.Dropout(0.1),
+        nn.Linear(512, 256),
+        nn.BatchNorm1d(256),
+        nn.ReLU(),
+        nn.Dropout(0.1),
+        nn.Linear(256, output_dim))
+
+
+class VRFClassifier(nn.Module):
+    """Pooled ResNet encoder + classifier head, laid out like CustomMedicalNet in 03_VRF_detection.
+
+    The encoder is built directly (no DataParallel, no pretrained weights
+    loaded), for checkpoints of the whole classifier.
+    """
+
+    def __init__(self, model_depth=50, input_shape=(100, 55, 55), shortcut_type='B', out_layer=4, output_dim=1):
+        super(VRFClassifier, self).__init__()
+        assert model_depth in [10, 18, 34, 50, 101, 152, 200]
+        self.encoder = getattr(resnet, 'resnet{}'.format(model_depth))(
+            sample_input_D=input_shape[0],
+            sample_input_H=input_shape[1],
+            sample_input_W=input_shape[2],
+            shortcut_type=shortcut_type,
+            no_cuda=True,
+            num_seg_classes=1,
+            features_only=True,
+            out_layer=out_layer,
+            global_pool=True)
+        self.classifier = classifier_head(self.encoder.out_channels, output_dim)
+
+    def forward(self, x):
+        return self.classifier(self.encoder(x))
+
+
+def load_classifier_state(path):
+    """State dict of a saved classifier (see model.load_checkpoint), without the 'module.' prefixes DataParallel adds."""
+    state_dict = load_checkpoint(path)
+    return {('.' + key).replace('.module.', '.')[1:]: value for key, value in state_dict.items()}
+
+
+def fold_batchnorm(model):
+    """Fold every BatchNorm into the Conv3d/Linear that feeds it, in place (eval mode only).
+
+    The pairs are convN/bnN inside ResNet and its blocks, and neighbours
+    inside nn.Sequential (downsample shortcuts, the head). A folded
+    BatchNorm is replaced by nn.Identity.
+    """
+    assert not model.training
+    for parent in list(model.modules()):
+        children = list(parent.named_children())
+        for i, (name, child) in enumerate(children):
+            if not isinstance(child, (nn.BatchNorm1d, nn.BatchNorm3d)):
+                continue
+
+            if isinstance(parent, nn.Sequential) and i > 0:
+                source_name, source = children[i - 1]
+            elif name.startswith('bn') and hasattr(parent, 'conv' + name[2:]):
+                source_name = 'conv' + name[2:]
+                source = getattr(parent, source_name)
+            else:
+                continue
+
+            if isinstance(source, nn.Conv3d):
+                setattr(parent, source_name, fuse_conv_bn_eval(source, child))
+            elif isinstance(source, nn.Linear):
+                setattr(parent, source_name, fuse_linear_bn_eval(source, child))
+            else:
+                continue
+            setattr(parent, name, nn.Identity())
+    return model
+
+
+class InferenceEngine:
+    """Batched CPU predictions of the VRF classifier, from a checkpoint loaded once.
+
+    The model is put in eval mode, its BatchNorms folded into the
+    preceding layers (fold_bn), its weights and inputs laid out
+    channels-last-3d (channels_last), and it is traced and frozen with
+    TorchScript (backend='script') or compiled with torch.compile
+    (backend='compile'); backend=None runs it eagerly. Predictions run
+    under torch.inference_mode, and the time per volume of every batch
+    is kept for latency().
+    """
+
+    def __init__(self, checkpoint, model_depth=50, input_shape=(100, 55, 55), out_layer=4, batch_size=8,
+                 fold_bn=True, channels_last=True, backend='script', threads=None):
+        assert backend in [None, 'script', 'compile']
+        if threads:
+            torch.set_num_threads(threads)
+
+        model = VRFClassifier(model_depth, input_shape, out_layer=out_layer)
+        if checkpoint is not None:
+            model.load_state_dict(load_classifier_state(checkpoint) if isinstance(checkpoint, str) else checkpoint)
+        model.eval()
+        if fold_bn:
+            fold_batchnorm(model)
+
+        self.input_shape = tuple(input_shape)
+        self.batch_size = batch_size
+        self.memory_format = torch.channels_last_3d if channels_last else torch.contiguous_format
+        model = model.to(memory_format=self.memory_format)
+
+        if backend == 'script':
+            example = self.prepare(torch.zeros((batch_size, 1) + self.input_shape))
+            with torch.no_grad():
+                model = torch.jit.freeze(torch.jit.trace(model, example))
+        elif backend == 'compile':
+            model = torch.compile(model)
+
+        self.model = model
+        self.latencies = []
+
+    def prepare(self, volumes):
+        """(N, 1, D, H, W) float32 tensor in the engine's memory format."""
+        volumes = torch.as_tensor(np.asarray(volumes, dtype=np.float32))
+        if volumes.dim() == 4:
+            volumes = volumes.unsqueeze(1)
+        return volumes.contiguous(memory_format=self.memory_format)
+
+    @torch.inference_mode()
+    def predict(self, volumes):
+        """VRF probabilities (N,) of (N, D, H, W) or (N, 1, D, H, W) volumes, batch_size at a time."""
+        volumes = self.prepare(volumes)
+        probabilities = []
+        for start in range(0, len(volumes), self.batch_size):
+            batch = volumes[start:start + self.batch_size]
+            begin = time.perf_counter()
+            logits = self.model(batch)
+            self.latencies.append((time.perf_counter() - begin) / len(batch))
+            probabilities.append(torch.sigmoid(logits).flatten())
+        return torch.cat(probabilities).numpy()
+
+    def latency(self):
+        """Per-volume latency over all predictions so far, in milliseconds (mean, median, p95).
+
+        The statistics are NaN until something has been predicted.
+        """
+        if not self.latencies:
+            return {'mean': float('nan'), 'median': float('nan'), 'p95': float('nan'), 'batches': 0}
+        latencies = np.array(self.latencies) * 1000
+        return {'mean': float(latencies.mean()), 'median': float(np.median(latencies)),
+                'p95': float(np.percentile(latencies, 95)), 'batches': len(latencies)}
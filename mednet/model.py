@@ -1,96 +1,108 @@
+import os
 import torch
 from torch import nn
 from models import resnet
 
 
+# Checkpoint key -> model key of partial pretrained loads, per (checkpoint file, model keys)
+_key_maps = {}
+
+
+def load_checkpoint(path):
+    """State dict of a checkpoint on the CPU, memory-mapped when the file format allows it."""
+    try:
+        checkpoint = torch.load(path, map_location='cpu', weights_only=True, mmap=True)
+    except RuntimeError:
+        # Legacy (pre-zipfile) checkpoints can't be memory-mapped
+        checkpoint = torch.load(path, map_location='cpu', weights_only=True)
+    return checkpoint.get('state_dict', checkpoint)
+
+
+def match_keys(path, checkpoint_keys, model_keys):
+    """Checkpoint keys that the model has, mapped to the model's keys.
+
+    DataParallel's 'module.' prefix is ignored on both sides. The mapping
+    is cached per checkpoint file (path, size and mtime) and model layout.
+    """
+    stat = os.stat(path)
+    model_keys = tuple(model_keys)
+    cache_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns, model_keys)
+    if cache_key not in _key_maps:
+        strip = lambda key: key[len('module.'):] if key.startswith('module.') else key
+        by_name = {strip(key): key for key in model_keys}
+        _key_maps[cache_key] = {key: by_name[strip(key)] for key in checkpoint_keys if strip(key) in by_name}
+    return _key_maps[cache_key]
+
+
+def load_pretrained(model, path):
+    """Load the matching weights of a checkpoint into a model built on the meta device.
+
+    Loaded tensors are assigned as they come out of the (memory-mapped)
+    checkpoint, without a copy into freshly initialised ones. Tensors the
+    checkpoint doesn't have are allocated and initialised as usual.
+    """
+    state_dict = load_checkpoint(path)
+    key_map = match_keys(path, state_dict.keys(), model.state_dict().keys())
+    model.load_state_dict({key_map[key]: value for key, value in state_dict.items() if key in key_map},
+                          strict=False, assign=True)
+
+    for module in model.modules():
+        tensors = dict(module.named_parameters(recurse=False), **dict(module.named_buffers(recurse=False)))
+        if not any(tensor.is_meta for tensor in tensors.values()):
+            continue
+        # Allocate and initialise the whole module, then put back what was loaded
+        for name, tensor in tensors.items():
+            empty = torch.empty(tensor.shape, dtype=tensor.dtype)
+            setattr(module, name, nn.Parameter(empty, tensor.requires_grad) if isinstance(tensor, nn.Parameter) else empty)
+        if hasattr(module, 'reset_parameters'):
+            module.reset_parameters()
+        resnet.init_weights(module)
+        for name, tensor in tensors.items():
+            if not tensor.is_meta:
+                setattr(module, name, tensor)
+    return model
+
+
 def generate_model(opt):
     assert opt.model in [
         'resnet'
     ]
 
+    # With pretrained weights the model is built on the meta device: no memory is
+    # allocated or initialised for weights that the checkpoint replaces anyway
+    pretrained = opt.phase != 'test' and opt.pretrain_path
+    device = torch.device('meta' if pretrained else 'cpu')
+
     if opt.model == 'resnet':
         assert opt.model_depth in [10, 18, 34, 50, 101, 152, 200]
-        
-        if opt.model_depth == 10:
-            model = resnet.resnet10(
-                sample_input_W=opt.input_W,
-                sample_input_H=opt.input_H,
-                sample_input_D=opt.input_D,
-                shortcut_type=opt.resnet_shortcut,
-                no_cuda=opt.no_cuda,
-                num_seg_classes=opt.n_seg_classes)
-        elif opt.model_depth == 18:
-            model = resnet.resnet18(
-                sample_input_W=opt.input_W,
-                sample_input_H=opt.input_H,
-                sample_input_D=opt.input_D,
-                shortcut_type=opt.resnet_shortcut,
-                no_cuda=opt.no_cuda,
-                num_seg_classes=opt.n_seg_classes)
-        elif opt.model_depth == 34:
-            model = resnet.resnet34(
-                sample_input_W=opt.input_W,
-                sample_input_H=opt.input_H,
-                sample_input_D=opt.input_D,
-                shortcut_type=opt.resnet_shortcut,
-                no_cuda=opt.no_cuda,
-                num_seg_classes=opt.n_seg_classes)
-        elif opt.model_depth == 50:
-            model = resnet.resnet50(
-                sample_input_W=opt.input_W,
-                sample_input_H=opt.input_H,
-                sample_input_D=opt.input_D,
-                shortcut_type=opt.resnet_shortcut,
-                no_cuda=opt.no_cuda,
-                num_seg_classes=opt.n_seg_classes)
-        elif opt.model_depth == 101:
-            model = resnet.resnet101(
-                sample_input_W=opt.input_W,
-                sample_input_H=opt.input_H,
-                sample_input_D=opt.input_D,
-                shortcut_type=opt.resnet_shortcut,
-                no_cuda=opt.no_cuda,
-                num_seg_classes=opt.n_seg_classes)
-        elif opt.model_depth == 152:
-            model = resnet.resnet152(
-                sample_input_W=opt.input_W,
-                sample_input_H=opt.input_H,
-                sample_input_D=opt.input_D,
-                shortcut_type=opt.resnet_shortcut,
-                no_cuda=opt.no_cuda,
-                num_seg_classes=opt.n_seg_classes)
-        elif opt.model_depth == 200:
-            model = resnet.resnet200(
+
+        # features_only: encoder without conv_seg, up to layer out_layer, optionally pooled (see resnet.ResNet)
+        with device:
+            model = getattr(resnet, 'resnet{}'.format(opt.model_depth))(
                 sample_input_W=opt.input_W,
                 sample_input_H=opt.input_H,
                 sample_input_D=opt.input_D,
                 shortcut_type=opt.resnet_shortcut,
                 no_cuda=opt.no_cuda,
-                num_seg_classes=opt.n_seg_classes)
+                num_seg_classes=opt.n_seg_classes,
+                features_only=getattr(opt, 'features_only', False),
+                out_layer=getattr(opt, 'out_layer', 4),
+                global_pool=getattr(opt, 'global_pool', False))
+
+    if pretrained:
+        print ('loading pretrained model {}'.format(opt.pretrain_path))
+        load_pretrained(model, opt.pretrain_path)
     
     if not opt.no_cuda:
         if len(opt.gpu_id) > 1:
             model = model.cuda() 
             model = nn.DataParallel(model, device_ids=opt.gpu_id)
-            net_dict = model.state_dict() 
         else:
-            import os
             os.environ["CUDA_VISIBLE_DEVICES"]=str(opt.gpu_id[0])
             model = model.cuda() 
             model = nn.DataParallel(model, device_ids=None)
-            net_dict = model.state_dict()
-    else:
-        net_dict = model.state_dict()
     
-    # load pretrain
-    if opt.phase != 'test' and opt.pretrain_path:
-        print ('loading pretrained model {}'.format(opt.pretrain_path))
-        pretrain = torch.load(opt.pretrain_path, weights_only=True)
-        pretrain_dict = {k: v for k, v in pretrain['state_dict'].items() if k in net_dict.keys()}
-         
-        net_dict.update(pretrain_dict)
-        model.load_state_dict(net_dict)
-
+    if pretrained:
         new_parameters = [] 
         for pname, p in model.named_parameters():
             for layer_name in opt.new_layer_names:
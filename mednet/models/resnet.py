@@ -109,7 +109,27 @@ class Bottleneck(nn.Module):
         return out
 
 
+def init_weights(m):
+    # ResNet initialisation of one module's own weights, skipped on the meta
+    # device (the weights are loaded or initialised after materialising)
+    if getattr(m, 'weight', None) is not None and m.weight.is_meta:
+        return
+    if isinstance(m, nn.Conv3d):
+        m.weight = nn.init.kaiming_normal(m.weight, mode='fan_out')
+    elif isinstance(m, nn.BatchNorm3d):
+        m.weight.data.fill_(1)
+        m.bias.data.zero_()
+
+
 class ResNet(nn.Module):
+    """3D ResNet with a segmentation head (conv_seg).
+
+    With features_only=True the network is a feature extractor: conv_seg
+    is never built, only the layers up to out_layer (1-4) are, and forward
+    returns that layer's feature map, or with global_pool=True its
+    average-pooled (N, out_channels) vector. Parameter names stay those of
+    the full network, so pretrained checkpoints load as they are.
+    """
 
     def __init__(self,
                  block,
@@ -119,9 +139,18 @@ class ResNet(nn.Module):
                  sample_input_W,
                  num_seg_classes,
                  shortcut_type='B',
-                 no_cuda = False):
+                 no_cuda = False,
+                 features_only=False,
+                 out_layer=4,
+                 global_pool=False):
+        assert out_layer in [1, 2, 3, 4]
+        assert features_only or (out_layer == 4 and not global_pool)
+
         self.inplanes = 64
         self.no_cuda = no_cuda
+        self.features_only = features_only
+        self.out_layer = out_layer
+        self.global_pool = global_pool
         super(ResNet, self).__init__()
         self.conv1 = nn.Conv3d(
             1,
@@ -134,46 +163,45 @@ class ResNet(nn.Module):
         self.bn1 = nn.BatchNorm3d(64)
         self.relu = nn.ReLU(inplace=True)
         self.maxpool = nn.MaxPool3d(kernel_size=(3, 3, 3), stride=2, padding=1)
-        self.layer1 = self._make_layer(block, 64, layers[0], shortcut_type)
-        self.layer2 = self._make_layer(
-            block, 128, layers[1], shortcut_type, stride=2)
-        self.layer3 = self._make_layer(
-            block, 256, layers[2], shortcut_type, stride=1, dilation=2)
-        self.layer4 = self._make_layer(
-            block, 512, layers[3], shortcut_type, stride=1, dilation=4)
-
-        self.conv_seg = nn.Sequential(
-                                        nn.ConvTranspose3d(
-                                        512 * block.expansion,
-                                        32,
-                                        2,
-                                        stride=2
-                                        ),
-                                        nn.BatchNorm3d(32),
-                                        nn.ReLU(inplace=True),
-                                        nn.Conv3d(
-                                        32,
-                                        32,
-                                        kernel_size=3,
-                                        stride=(1, 1, 1),
-                                        padding=(1, 1, 1),
-                                        bias=False), 
-                                        nn.BatchNorm3d(32),
-                                        nn.ReLU(inplace=True),
-                                        nn.Conv3d(
-                                        32,
-                                        num_seg_classes,
-                                        kernel_size=1,
-                                        stride=(1, 1, 1),
-                                        bias=False) 
-                                        )
+
+        # (planes, stride, dilation) of layer1-4; layers after out_layer are not built
+        layer_specs = [(64, 1, 1), (128, 2, 1), (256, 1, 2), (512, 1, 4)]
+        for i, (planes, stride, dilation) in enumerate(layer_specs[:out_layer]):
+            setattr(self, 'layer%d' % (i + 1), self._make_layer(
+                block, planes, layers[i], shortcut_type, stride=stride, dilation=dilation))
+        self.out_channels = self.inplanes
+
+        if features_only:
+            self.pool = nn.AdaptiveAvgPool3d(1) if global_pool else None
+        else:
+            self.conv_seg = nn.Sequential(
+                                            nn.ConvTranspose3d(
+                                            512 * block.expansion,
+                                            32,
+                                            2,
+                                            stride=2
+                                            ),
+                                            nn.BatchNorm3d(32),
+                                            nn.ReLU(inplace=True),
+                                            nn.Conv3d(
+                                            32,
+                                            32,
+                                            kernel_size=3,
+                                            stride=(1, 1, 1),
+                                            padding=(1, 1, 1),
+                                            bias=False), 
+                                            nn.BatchNorm3d(32),
+                                            nn.ReLU(inplace=True),
+                                            nn.Conv3d(
+                                            32,
+                                            num_seg_classes,
+                                            kernel_size=1,
+                                            stride=(1, 1, 1),
+                                            bias=False) 
+                                            )
 
         for m in self.modules():
-            if isinstance(m, nn.Conv3d):
-                m.weight = nn.init.kaiming_normal(m.weight, mode='fan_out')
-            elif isinstance(m, nn.BatchNorm3d):
-                m.weight.data.fill_(1)
-                m.bias.data.zero_()
+            init_weights(m)
 
     def _make_layer(self, block, planes, blocks, shortcut_type, stride=1, dilation=1):
         downsample = None
@@ -206,10 +234,11 @@ class ResNet(nn.Module):
         x = self.bn1(x)
         x = self.relu(x)
         x = self.maxpool(x)
-        x = self.layer1(x)
-        x = self.layer2(x)
-        x = self.layer3(x)
-        x = self.layer4(x)
+        for i in range(1, self.out_layer + 1):
+            x = getattr(self, 'layer%d' % i)(x)
+
+        if self.features_only:
+            return torch.flatten(self.pool(x), 1) if self.global_pool else x
         x = self.conv_seg(x)
 
         return x
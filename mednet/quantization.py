@@ -0,0 +1,95 @@
+import io
+import copy
+import time
+import numpy as np
+import torch
+from torch import nn
+from torch.ao.quantization import get_default_qconfig_mapping, quantize_dynamic
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+
+def batches(volumes, batch_size):
+    """(N, 1, D, H, W) float32 tensors of batch_size volumes from an (N, D, H, W) or (N, 1, D, H, W) array."""
+    for start in range(0, len(volumes), batch_size):
+        batch = torch.from_numpy(np.asarray(volumes[start:start + batch_size], dtype=np.float32))
+        yield batch.unsqueeze(1) if batch.dim() == 4 else batch
+
+
+def quantize_static(model, calibration, batch_size=8, backend='x86'):
+    """INT8 copy of a float model (e.g. inference.VRFClassifier), weights and activations.
+
+    The model is traced with torch.fx: conv + batch norm + relu and the
+    residual add + relu are fused, observers record activation ranges on
+    the calibration volumes (a few hundred crops are enough), then every
+    Conv3d and Linear is replaced by its quantized version. The model is
+    not changed.
+    """
+    torch.backends.quantized.engine = backend
+    model = copy.deepcopy(model).eval()
+    example = next(batches(calibration, batch_size))
+    prepared = prepare_fx(model, get_default_qconfig_mapping(backend), (example,))
+
+    with torch.inference_mode():
+        for batch in batches(calibration, batch_size):
+            prepared(batch)
+    return convert_fx(prepared)
+
+
+def quantize_linear(model):
+    """Copy of a float model with dynamically quantized (INT8 weight) Linear layers, no calibration needed.
+
+    Only the classifier head is affected: PyTorch has no dynamic
+    quantization for Conv3d.
+    """
+    return quantize_dynamic(copy.deepcopy(model).eval(), {nn.Linear}, dtype=torch.qint8)
+
+
+def model_size(model):
+    """Size of the model's serialized state dict in bytes."""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+
+@torch.inference_mode()
+def predict(model, volumes, batch_size=8):
+    """Probabilities (N,) of a single-logit classifier, and the mean time per volume in milliseconds."""
+    probabilities, elapsed = [], 0.0
+    for batch in batches(volumes, batch_size):
+        begin = time.perf_counter()
+        logits = model(batch)
+        elapsed += time.perf_counter() - begin
+        probabilities.append(torch.sigmoid(logits).flatten())
+    return torch.cat(probabilities).numpy(), elapsed / len(volumes) * 1000
+
+
+def quantization_report(models, volumes, labels, batch_size=8, threshold=0.5):
+    """Accuracy, agreement, latency and size of quantized models against the float one.
+
+    models maps a name to a model, the first one being the float reference
+    (e.g. {'float32': model, 'int8': quantize_static(model, x_cal)}).
+    volumes/labels are held-out crops. Returns one dict per model with its
+    accuracy, the accuracy delta and the largest probability difference
+    against the reference, the share of identical decisions, the time per
+    volume (ms) and the state dict size (MB).
+    """
+    labels = np.asarray(labels).astype(int).flatten()
+    report, reference = {}, None
+    for name, model in models.items():
+        # One untimed batch first, so one-off setup isn't counted
+        predict(model, volumes[:batch_size], batch_size)
+        probabilities, latency = predict(model, volumes, batch_size)
+        decisions = (probabilities > threshold).astype(int)
+        if reference is None:
+            reference = probabilities, decisions
+
+        accuracy = float((decisions == labels).mean())
+        report[name] = {
+            'accuracy': accuracy,
+            'accuracy_delta': accuracy - float(((reference[0] > threshold).astype(int) == labels).mean()),
+            'max_probability_delta': float(np.abs(probabilities - reference[0]).max()),
+            'agreement': float((decisions == reference[1]).mean()),
+            'ms_per_volume': latency,
+            'size_mb': model_size(model) / 2 ** 20,
+        }
+    return report
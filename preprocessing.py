@@ -0,0 +1,509 @@
+"""Incremental preprocessing pipeline: DCOM -> Array -> XY_Crop -> Z_Crop -> Final.
+
+Runs the steps of 01_preprocessing.ipynb from the command line. Every
+output is rebuilt only when its fingerprint changes. The fingerprint is a
+content hash of the output's inputs (source volumes or DICOM files plus the
+coordinate CSV) together with the stage parameters. Adding studies or
+fixing one coordinate file only reruns the outputs that depend on them.
+
+    python preprocessing.py --root Dataset
+    python preprocessing.py --root Dataset --stages z_crop final --dry-run
+
+Output names stay stable between runs. Array and XY_Crop numbers are
+assigned once and recorded in the manifest (Dataset/.pipeline.json),
+because the hand-made XY/Z coordinate files are named after them. New
+studies and teeth get the next free number.
+
+Each stage folder also gets a metadata index (.metadata.csv, see
+volume_index) with the shape, value range, label, patient code, source
+study and crop coordinates of every volume, filled in as outputs are built.
+"""
+
+import os
+import cv2
+import json
+import math
+import hashlib
+import argparse
+import numpy as np
+import pandas as pd
+from dicom_series import load_series
+from volume_store import save_volume, load_volume, open_volume
+from rotated_rect_crop import crop_rotated_volume
+from volume_index import MetadataIndex, volume_stats, crop_name_fields, ORIGIN_COLUMNS
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+MANIFEST_FILE = ".pipeline.json"
+MANIFEST_VERSION = 1
+
+# Bump a stage's version when its code changes, so its outputs are rebuilt
+STAGE_VERSIONS = {"array": 1, "xy_crop": 1, "z_crop": 1, "final": 2}
+STAGES = tuple(STAGE_VERSIONS)
+
+DEFAULT_PARAMS = {"margin": 0, "max_z_length": 200, "target_shape": (150, 55, 55)}
+
+
+def perpendicular_line(x1, y1, x2, y2):
+    """Endpoints of the line of the same length through the midpoint of (x1, y1)-(x2, y2), at right angles to it."""
+    # Calculate the midpoint
+    mx, my = (x1 + x2) / 2, (y1 + y2) / 2
+
+    # Calculate the length of the original line segment
+    length = math.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
+
+    # Calculate the direction vector of the original line
+    dx, dy = x2 - x1, y2 - y1
+
+    # Perpendicular vector (swap dx and dy and negate one)
+    px, py = -dy, dx
+
+    # Normalize the perpendicular vector to match the length of the original line
+    scale = length / (2 * math.sqrt(px ** 2 + py ** 2))
+    px, py = px * scale, py * scale
+
+    # Calculate the endpoints of the perpendicular line
+    new_x1, new_y1 = mx + px, my + py
+    new_x2, new_y2 = mx - px, my - py
+
+    return (new_x1, new_y1, new_x2, new_y2)
+
+
+def tooth_rect(x1, y1, x2, y2, new_x1, new_y1, new_x2, new_y2):
+    """Integer rotated rect ((cx, cy), (w, h), angle) of the square spanned by a tooth line and its perpendicular."""
+    # Calculate side vectors
+    dx1, dy1 = x2 - x1, y2 - y1
+    dx2, dy2 = new_x2 - new_x1, new_y2 - new_y1
+
+    # Normalize the direction vectors to find their lengths
+    len1 = np.sqrt(dx1**2 + dy1**2)
+    len2 = np.sqrt(dx2**2 + dy2**2)
+    dx1, dy1 = dx1 / len1, dy1 / len1
+    dx2, dy2 = dx2 / len2, dy2 / len2
+
+    # Calculate half the side length
+    half_side_length = len1 / 2
+
+    # Calculate the four corners based on the midpoints
+    corners = np.array([
+        [int(x1 + dx2 * half_side_length), int(y1 + dy2 * half_side_length)],  # Top right
+        [int(x1 - dx2 * half_side_length), int(y1 - dy2 * half_side_length)],  # Top left
+        [int(x2 + dx2 * half_side_length), int(y2 + dy2 * half_side_length)],  # Bottom right
+        [int(x2 - dx2 * half_side_length), int(y2 - dy2 * half_side_length)]   # Bottom left
+    ], dtype=np.int32)
+
+    rect = cv2.minAreaRect(corners.astype(np.float32))
+
+    center = (int(rect[0][0]), int(rect[0][1]))
+    size = (int(rect[1][0]), int(rect[1][1]))
+    angle = int(rect[2])
+
+    return (center, size, angle)
+
+
+def tooth_rects(points, margin=0):
+    """Rotated rects and labels for the tooth lines of one XY coordinates table (x1, y1, x2, y2, Label)."""
+    rects, labels = [], []
+    for row in points.iloc:
+        x1 = int(row['x1']) - margin
+        y1 = int(row['y1']) - margin
+        x2 = int(row['x2']) + margin
+        y2 = int(row['y2']) + margin
+
+        new_x1, new_y1, new_x2, new_y2 = perpendicular_line(x1, y1, x2, y2)
+        new_x1, new_y1, new_x2, new_y2 = int(new_x1), int(new_y1), int(new_x2), int(new_y2)
+
+        rects.append(tooth_rect(x1, y1, x2, y2, new_x1, new_y1, new_x2, new_y2))
+        labels.append(str(int(row['Label'])))
+
+    return rects, labels
+
+
+def linear_weights(n_in, n_out):
+    """Source indices and weights of order-1 resampling from n_in to n_out samples (scipy.ndimage.zoom's grid)."""
+    # Corners are aligned: output i samples input i * (n_in - 1) / (n_out - 1)
+    step = (n_in - 1) / (n_out - 1) if n_out > 1 else 1.0
+    coords = np.arange(n_out, dtype=np.float64) * step
+    lo = np.minimum(np.floor(coords).astype(np.intp), n_in - 1)
+    hi = np.minimum(lo + 1, n_in - 1)
+    weight = (coords - lo).astype(np.float32)
+    return lo, hi, weight
+
+
+def resample_axis(array, axis, n_out):
+    """Linear resampling of an array along one axis, as float32."""
+    if array.shape[axis] == n_out and array.dtype == np.float32:
+        return array
+
+    lo, hi, weight = linear_weights(array.shape[axis], n_out)
+    shape = [1] * array.ndim
+    shape[axis] = n_out
+    weight = weight.reshape(shape)
+
+    # Only the planes that are sampled are converted to float32
+    low = np.take(array, lo, axis=axis).astype(np.float32, copy=False)
+    high = np.take(array, hi, axis=axis).astype(np.float32, copy=False)
+    high -= low
+    high *= weight
+    low += high
+    return low
+
+
+def resize_and_pad(array, target_shape=(150, 55, 55), out=None):
+    """Scale a (z, y, x) volume to fit target_shape, keeping its aspect ratio, and zero-pad it centered.
+
+    Separable float32 linear interpolation, equivalent to
+    scipy.ndimage.zoom(order=1) within float32 rounding. The resized volume
+    is written straight into its place in out (a new zeroed array of
+    target_shape if not given), with no intermediate padded copy. Each axis
+    is resampled in turn, starting with the one that shrinks the most, so
+    the later passes work on less data.
+    """
+    z, y, x = array.shape
+    target_z, target_yx, target_yx = target_shape
+
+    # Calculate scaling factors
+    scale_z = target_z / z
+    scale_yx = target_yx / max(y, x)
+
+    # Select the smaller scaling factor to preserve aspect ratio
+    scale = min(scale_z, scale_yx)
+
+    # Same output size as zoom
+    resized_shape = tuple(int(round(size * scale)) for size in array.shape)
+    rz, ry, rx = resized_shape
+
+    if out is None:
+        out = np.zeros(target_shape, dtype=array.dtype)
+
+    # Resample axis by axis in float32, the most shrinking axis first
+    resized = np.asarray(array)
+    for axis in sorted(range(3), key=lambda axis: resized_shape[axis] / array.shape[axis]):
+        resized = resample_axis(resized, axis, resized_shape[axis])
+
+    # Calculate padding offsets
+    z_offset = (target_z - rz) // 2
+    y_offset = (target_yx - ry) // 2
+    x_offset = (target_yx - rx) // 2
+
+    # Insert the resized array into its place in the padded output
+    region = out[z_offset:z_offset + rz, y_offset:y_offset + ry, x_offset:x_offset + rx]
+    if out.dtype.kind in "ui":
+        np.rint(resized, out=resized)
+        info = np.iinfo(out.dtype)
+        np.clip(resized, info.min, info.max, out=resized)
+    region[...] = resized
+
+    return out
+
+
+def resize_volume_file(source_path, target_shape, output_path):
+    """Load, resize_and_pad and save one volume (runs in a worker process); returns the path and volume_stats."""
+    resized = resize_and_pad(load_volume(source_path), target_shape)
+    save_volume(output_path, resized)
+    return output_path, volume_stats(resized)
+
+
+class Manifest:
+    """Fingerprints, output keys and stable output numbers of one dataset, kept in Dataset/.pipeline.json.
+
+    files caches the content hash of every file read by the pipeline under
+    its (size, mtime) stamp, so unchanged inputs aren't read again to be
+    hashed. outputs maps stage -> output name -> key of the inputs it was
+    built from. ids holds the numbers given to studies (Array) and teeth
+    (XY_Crop).
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.path = os.path.join(root, MANIFEST_FILE)
+        self.files, self.outputs, self.ids = {}, {stage: {} for stage in STAGES}, {"array": {}, "xy_crop": {}}
+
+        try:
+            with open(self.path) as file:
+                manifest = json.load(file)
+        except (OSError, ValueError):
+            return
+        if manifest.get("version") != MANIFEST_VERSION:
+            return
+
+        self.files = manifest["files"]
+        self.outputs.update(manifest["outputs"])
+        self.ids.update(manifest["ids"])
+
+    def save(self):
+        manifest = {"version": MANIFEST_VERSION, "files": self.files, "outputs": self.outputs, "ids": self.ids}
+        with open(self.path + ".tmp", "w") as file:
+            json.dump(manifest, file)
+        os.replace(self.path + ".tmp", self.path)
+
+    def file_hash(self, path):
+        """Content hash of a file, read only when its size or mtime changed since it was last hashed."""
+        stat = os.stat(path)
+        # Relative to the dataset, so the cache survives moving it or running from elsewhere
+        name = os.path.relpath(path, self.root)
+        cached = self.files.get(name)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+
+        digest = hashlib.sha1()
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                digest.update(block)
+
+        self.files[name] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def folder_hash(self, folder):
+        """Content hash of all files in a folder (names and contents)."""
+        digest = hashlib.sha1()
+        for name in sorted(os.listdir(folder)):
+            path = os.path.join(folder, name)
+            if os.path.isfile(path) and not name.startswith("."):
+                digest.update(name.encode() + b"\0" + self.file_hash(path).encode())
+        return digest.hexdigest()
+
+    def number(self, kind, source, width):
+        """Stable zero-padded number for a source, the next free one if it has none yet."""
+        ids = self.ids[kind]
+        if source not in ids:
+            ids[source] = max(ids.values(), default=-1) + 1
+        return str(ids[source]).zfill(width)
+
+
+def job_key(stage, params, *inputs):
+    """Fingerprint of one output: stage, its code version, its parameters and the hashes of its inputs."""
+    payload = json.dumps([stage, STAGE_VERSIONS[stage], params, inputs], sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+class Pipeline:
+    """Runs the preprocessing stages over a dataset folder, rebuilding only what changed."""
+
+    def __init__(self, root, params=None, force=False, dry_run=False, workers=None):
+        self.root = root
+        self.params = dict(DEFAULT_PARAMS, **(params or {}))
+        self.force = force
+        self.dry_run = dry_run
+        self.workers = workers
+        self.manifest = Manifest(root)
+        self.metadata = {stage: MetadataIndex(self.path(self.output_dir(stage))) for stage in STAGES}
+        self.built = self.skipped = 0
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def run(self, stages=STAGES):
+        for stage in STAGES:
+            if stage in stages:
+                os.makedirs(self.path(self.output_dir(stage)), exist_ok=True)
+                getattr(self, "stage_" + stage)()
+                self.save_metadata(stage)
+        print(f"{self.built} outputs built, {self.skipped} up to date")
+
+    @staticmethod
+    def output_dir(stage):
+        return {"array": "Array", "xy_crop": "XY_Crop", "z_crop": "Z_Crop", "final": "Final"}[stage]
+
+    def up_to_date(self, stage, name, key):
+        if self.force or self.manifest.outputs[stage].get(name) != key:
+            return False
+        return os.path.exists(self.path(self.output_dir(stage), name))
+
+    def build(self, stage, keys, make):
+        """Rebuild the outputs (name -> key, in the stage folder) that are out of date.
+
+        make(names) returns the arrays of the given outputs, in order.
+        """
+        names = [name for name, key in keys.items() if not self.up_to_date(stage, name, key)]
+        self.skipped += len(keys) - len(names)
+        if not names:
+            return
+
+        print(f"[{stage}] building {', '.join(names)}")
+        self.built += len(names)
+        if self.dry_run:
+            return
+
+        for name, array in zip(names, make(names)):
+            path = self.path(self.output_dir(stage), name)
+            save_volume(path, array)
+            self.metadata[stage].record(name, volume_stats(array))
+            self.manifest.outputs[stage][name] = keys[name]
+            # Hashed while still in the page cache, for the next stage's key
+            self.manifest.file_hash(path)
+
+        # Saved after every build, so an interrupted run resumes where it stopped
+        self.manifest.save()
+
+    def build_parallel(self, stage, jobs, worker):
+        """Rebuild out-of-date outputs in a process pool.
+
+        jobs maps output name -> (key, args); worker(*args, output_path)
+        writes one output. Each finished output is recorded right away.
+        """
+        names = [name for name, (key, _) in jobs.items() if not self.up_to_date(stage, name, key)]
+        self.skipped += len(jobs) - len(names)
+        if not names:
+            return
+
+        print(f"[{stage}] building {len(names)} outputs")
+        self.built += len(names)
+        if self.dry_run:
+            return
+
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(worker, *jobs[name][1], self.path(self.output_dir(stage), name)): name
+                       for name in names}
+            for future in as_completed(futures):
+                name = futures[future]
+                path, stats = future.result()
+                self.manifest.file_hash(path)
+                self.metadata[stage].record(name, stats)
+                self.manifest.outputs[stage][name] = jobs[name][0]
+                self.manifest.save()
+
+    def remove_stale(self, stage, current):
+        """Delete outputs this pipeline built earlier whose inputs have gone (never files it didn't build)."""
+        for name in list(self.manifest.outputs[stage]):
+            if name in current:
+                continue
+            print(f"[{stage}] removing stale {name}")
+            if not self.dry_run:
+                path = self.path(self.output_dir(stage), name)
+                if os.path.exists(path):
+                    os.remove(path)
+                del self.manifest.outputs[stage][name]
+        if not self.dry_run:
+            self.manifest.save()
+
+    def save_metadata(self, stage):
+        """Bring the stage's metadata index up to date with its folder; only volumes it has no statistics for are read."""
+        if self.dry_run:
+            return
+        self.metadata[stage].refresh()
+        self.metadata[stage].save()
+
+    def origin(self, stage, name):
+        """Origin columns (label, code, crop coordinates...) of an earlier stage's output, for what is made from it."""
+        row = self.metadata[stage].rows.get(name, {})
+        return {column: row[column] for column in ORIGIN_COLUMNS if column in row}
+
+    def stage_array(self):
+        """DCOM/<folder>/<study>/ -> Array/<NNN>.vol"""
+        dicom_root = self.path("DCOM")
+        current = set()
+        for folder in sorted(os.listdir(dicom_root)):
+            for study in sorted(os.listdir(os.path.join(dicom_root, folder))):
+                study_path = os.path.join(dicom_root, folder, study)
+                if not os.path.isdir(study_path):
+                    continue
+
+                name = self.manifest.number("array", folder + "/" + study, 3) + ".vol"
+                key = job_key("array", {}, self.manifest.folder_hash(study_path))
+                self.build("array", {name: key}, lambda names: [load_series(study_path)])
+                self.metadata["array"].update(name, scan=name[:-4], study=folder + "/" + study)
+                current.add(name)
+
+        self.remove_stale("array", current)
+
+    def stage_xy_crop(self):
+        """Array/<scan>.vol + XY_Coordinates/<scan>.csv -> XY_Crop/<NNNN>_<label>_<scan>.vol, one per tooth"""
+        coordinates = self.path("XY_Coordinates")
+        current = set()
+        for file in sorted(os.listdir(coordinates)):
+            scan = file[:-4]
+            array_path = self.path("Array", scan + ".vol")
+            if not file.endswith(".csv") or not os.path.exists(array_path):
+                continue
+
+            csv_path = os.path.join(coordinates, file)
+            points = pd.read_csv(csv_path)
+            rects, labels = tooth_rects(points, self.params["margin"])
+
+            # Each tooth is keyed on its own rect, so fixing one line only recrops that tooth
+            array_hash = self.manifest.file_hash(array_path)
+            keys, tooth = {}, {}
+            for row, (rect, label) in enumerate(zip(rects, labels)):
+                name = self.manifest.number("xy_crop", f"{scan}:{row}", 4) + "_" + label + "_" + scan + ".vol"
+                keys[name] = job_key("xy_crop", {"margin": self.params["margin"]}, array_hash, rect)
+                tooth[name] = rect
+
+                (center_x, center_y), (width, height), angle = rect
+                origin = dict(self.origin("array", scan + ".vol"), **crop_name_fields(name))
+                self.metadata["xy_crop"].update(name, center_x=center_x, center_y=center_y,
+                                                rect_width=width, rect_height=height, angle=angle, **origin)
+
+            # The scan is read once and all of its out-of-date teeth are cropped together
+            self.build("xy_crop", keys,
+                       lambda names: crop_rotated_volume(load_volume(array_path), [tooth[name] for name in names]))
+            current.update(keys)
+
+        self.remove_stale("xy_crop", current)
+
+    def stage_z_crop(self):
+        """XY_Crop/<crop>.vol + Z_Coordinates/<crop>.csv -> Z_Crop/<crop>.vol"""
+        coordinates = self.path("Z_Coordinates")
+        max_length = self.params["max_z_length"]
+        current = set()
+        for file in sorted(os.listdir(coordinates)):
+            name = file[:-4] + ".vol"
+            crop_path = self.path("XY_Crop", name)
+            if not file.endswith(".csv") or not os.path.exists(crop_path):
+                continue
+
+            csv_path = os.path.join(coordinates, file)
+            zcords = pd.read_csv(csv_path)
+            y1, y2 = int(zcords.iloc[0]['y1']), int(zcords.iloc[0]['y2'])
+            # Recorded with the XY crop, so Z lengths can be checked from its index, skipped ones included
+            self.metadata["xy_crop"].update(name, z1=y1, z2=y2)
+            if y2 - y1 > max_length:
+                # Mislabelled range, as in the notebook
+                continue
+
+            key = job_key("z_crop", {"max_z_length": max_length},
+                          self.manifest.file_hash(crop_path), self.manifest.file_hash(csv_path))
+            # Opened lazily, so only the chunks inside [y1, y2) are read
+            self.build("z_crop", {name: key}, lambda names: [open_volume(crop_path)[y1:y2, :, :]])
+            self.metadata["z_crop"].update(name, **self.origin("xy_crop", name))
+            current.add(name)
+
+        self.remove_stale("z_crop", current)
+        self.save_metadata("xy_crop")
+
+    def stage_final(self):
+        """Z_Crop/<crop>.vol -> Final/<crop>.vol, resized and padded to target_shape"""
+        target_shape = tuple(self.params["target_shape"])
+        jobs = {}
+        for name in sorted(os.listdir(self.path("Z_Crop"))):
+            if not name.endswith(".vol"):
+                continue
+
+            crop_path = self.path("Z_Crop", name)
+            key = job_key("final", {"target_shape": target_shape}, self.manifest.file_hash(crop_path))
+            jobs[name] = (key, (crop_path, target_shape))
+            self.metadata["final"].update(name, **self.origin("z_crop", name))
+
+        # Many small independent volumes, resized in parallel
+        self.build_parallel("final", jobs, resize_volume_file)
+        self.remove_stale("final", jobs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incremental DCOM -> Array -> XY_Crop -> Z_Crop -> Final preprocessing.")
+    parser.add_argument("--root", default="Dataset", help="dataset folder with DCOM, XY_Coordinates and Z_Coordinates")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES), help="stages to run (in pipeline order)")
+    parser.add_argument("--margin", type=int, default=DEFAULT_PARAMS["margin"], help="margin added around tooth lines")
+    parser.add_argument("--max-z-length", type=int, default=DEFAULT_PARAMS["max_z_length"], help="skip Z ranges longer than this")
+    parser.add_argument("--target-shape", type=int, nargs=3, default=DEFAULT_PARAMS["target_shape"], help="final (z, y, x) shape")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes for the final resize (default: all cores)")
+    parser.add_argument("--force", action="store_true", help="rebuild every output of the selected stages")
+    parser.add_argument("--dry-run", action="store_true", help="only list what would be rebuilt")
+    args = parser.parse_args()
+
+    params = {"margin": args.margin, "max_z_length": args.max_z_length, "target_shape": tuple(args.target_shape)}
+    Pipeline(args.root, params, force=args.force, dry_run=args.dry_run, workers=args.workers).run(args.stages)
+
+
+if __name__ == "__main__":
+    main()
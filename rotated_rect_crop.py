@@ -154,6 +154,194 @@ def crop_rotated_rectangle(image, rect):
 
 
 
+def rects_array(rects):
+    # Stack rects ((center_x, center_y), (width, height), angle) into an (N, 5) array
+    # Columns: center_x, center_y, width, height, angle; an (N, 5) array is passed through
+
+    if isinstance(rects, np.ndarray):
+        return rects.reshape(-1, 5)
+
+    return np.array([[rect[0][0], rect[0][1], rect[1][0], rect[1][1], rect[2]] for rect in rects], dtype=np.float64).reshape(-1, 5)
+
+
+def box_points(rects):
+    # cv2.boxPoints for an (N, 5) array of rects at once
+    # Same float32 formulas as OpenCV, but not its operation order: the corners agree with
+    # cv2.boxPoints within float32 precision (last ulp), so an int() truncation can only differ
+    # for a corner lying on an integer coordinate
+    # Return:
+    # (N, 4, 2) corners (x, y)
+
+    rects = rects_array(rects)
+    angle = np.deg2rad(rects[:, 4])
+    b = (np.cos(angle).astype(np.float32) * np.float32(0.5))
+    a = (np.sin(angle).astype(np.float32) * np.float32(0.5))
+    center_x, center_y, width, height = (rects[:, i].astype(np.float32) for i in range(4))
+
+    box = np.empty((len(rects), 4, 2), dtype=np.float32)
+    box[:, 0, 0] = center_x - a * height - b * width
+    box[:, 0, 1] = center_y + b * height - a * width
+    box[:, 1, 0] = center_x + a * height - b * width
+    box[:, 1, 1] = center_y - b * height - a * width
+    box[:, 2, 0] = 2 * center_x - box[:, 0, 0]
+    box[:, 2, 1] = 2 * center_y - box[:, 0, 1]
+    box[:, 3, 0] = 2 * center_x - box[:, 1, 0]
+    box[:, 3, 1] = 2 * center_y - box[:, 1, 1]
+
+    return box
+
+
+def inside_rects(rects, num_cols, num_rows):
+    # inside_rect for an (N, 5) array of rects
+    # Return:
+    # (N,) bool array
+
+    rects = rects_array(rects)
+    box = box_points(rects)
+
+    x_max = np.trunc(box[:, :, 0].max(axis=1))
+    x_min = np.trunc(box[:, :, 0].min(axis=1))
+    y_max = np.trunc(box[:, :, 1].max(axis=1))
+    y_min = np.trunc(box[:, :, 1].min(axis=1))
+
+    center_inside = (rects[:, 0] >= 0) & (rects[:, 0] <= num_cols) & (rects[:, 1] >= 0) & (rects[:, 1] <= num_rows)
+
+    return center_inside & (x_max <= num_cols) & (x_min >= 0) & (y_max <= num_rows) & (y_min >= 0)
+
+
+def rects_bbx(rects):
+    # rect_bbx for an (N, 5) array of rects
+    # Return:
+    # (N, 5) int array of upright bounding boxes (angle 0)
+
+    box = box_points(rects)
+
+    x_max = np.trunc(box[:, :, 0].max(axis=1)).astype(np.int64)
+    x_min = np.trunc(box[:, :, 0].min(axis=1)).astype(np.int64)
+    y_max = np.trunc(box[:, :, 1].max(axis=1)).astype(np.int64)
+    y_min = np.trunc(box[:, :, 1].min(axis=1)).astype(np.int64)
+
+    bbx = np.zeros((len(box), 5), dtype=np.int64)
+    bbx[:, 0] = (x_min + x_max) // 2
+    bbx[:, 1] = (y_min + y_max) // 2
+    bbx[:, 2] = x_max - x_min
+    bbx[:, 3] = y_max - y_min
+
+    return bbx
+
+
+def rects_affine(rects):
+    # Affine transforms that crop_rotated_rectangle applies to the upright bounding boxes of rects
+    # Composes the rotation of image_rotate_without_crop with the final center crop, so a single
+    # warp of the bounding box gives the rotated crop directly, with no intermediate rotated image
+    # Return:
+    # bbx_corners: (N, 4) int array (x0, y0, x1, y1) of the bounding boxes in the image
+    # matrices: (N, 2, 3) affine matrices from bounding box pixels to crop pixels
+    # sizes: (N, 2) int array (width, height) of the crops
+
+    rects = rects_array(rects)
+    bbx = rects_bbx(rects)
+    bbx_center_x, bbx_center_y, bbx_width, bbx_height = bbx[:, 0], bbx[:, 1], bbx[:, 2], bbx[:, 3]
+
+    # Same slicing as crop_rectangle
+    x0 = bbx_center_x - bbx_width // 2
+    y0 = bbx_center_y - bbx_height // 2
+    bbx_corners = np.stack([x0, y0, x0 + bbx_width, y0 + bbx_height], axis=1)
+
+    # Same geometry as cv2.getRotationMatrix2D and image_rotate_without_crop
+    image_center_x, image_center_y = bbx_width / 2, bbx_height / 2
+    angle = np.deg2rad(rects[:, 4])
+    alpha, beta = np.cos(angle), np.sin(angle)
+
+    matrices = np.empty((len(rects), 2, 3), dtype=np.float64)
+    matrices[:, 0, 0] = alpha
+    matrices[:, 0, 1] = beta
+    matrices[:, 0, 2] = (1 - alpha) * image_center_x - beta * image_center_y
+    matrices[:, 1, 0] = -beta
+    matrices[:, 1, 1] = alpha
+    matrices[:, 1, 2] = beta * image_center_x + (1 - alpha) * image_center_y
+
+    abs_cos, abs_sin = np.abs(alpha), np.abs(beta)
+    bound_w = (bbx_height * abs_sin + bbx_width * abs_cos).astype(np.int64)
+    bound_h = (bbx_height * abs_cos + bbx_width * abs_sin).astype(np.int64)
+
+    matrices[:, 0, 2] += bound_w / 2 - image_center_x
+    matrices[:, 1, 2] += bound_h / 2 - image_center_y
+
+    # Same center crop as crop_rotated_rectangle
+    sizes = rects[:, 2:4].astype(np.int64)
+    matrices[:, 0, 2] -= bound_w // 2 - sizes[:, 0] // 2
+    matrices[:, 1, 2] -= bound_h // 2 - sizes[:, 1] // 2
+
+    return bbx_corners, matrices, sizes
+
+
+def crop_rotated_rectangles(image, rects):
+    # crop_rotated_rectangle for many rects of the same image
+    # Bounds and bounding boxes are computed for all rects at once, and each crop is sampled
+    # with one warpAffine straight into its preallocated output
+    # Return:
+    # list of crops, None for rectangles that are not fully in the image
+
+    rects = rects_array(rects)
+    inside = inside_rects(rects, num_cols = image.shape[1], num_rows = image.shape[0])
+    bbx_corners, matrices, sizes = rects_affine(rects)
+
+    crops = []
+    for i in range(len(rects)):
+        if not inside[i]:
+            print("Proposed rectangle is not fully in the image.")
+            crops.append(None)
+            continue
+
+        x0, y0, x1, y1 = bbx_corners[i]
+        rect_width, rect_height = int(sizes[i, 0]), int(sizes[i, 1])
+
+        cropped = np.empty((rect_height, rect_width) + image.shape[2:], dtype=image.dtype)
+        cv2.warpAffine(image[y0:y1, x0:x1], matrices[i], (rect_width, rect_height), dst=cropped)
+        crops.append(cropped)
+
+    return crops
+
+
+def crop_rotated_volume(volume, rects):
+    # Crop rotated rectangles from every slice of a (z, y, x) volume
+    # rect, list of rects or (N, 5) array as in crop_rotated_rectangles, e.g. one per tooth of the same scan
+    # The geometry is computed once for all rects and every slice is warped straight into the
+    # preallocated (z, height, width) output, instead of cropping, rotating and re-cropping
+    # each slice separately
+    # Return:
+    # (z, height, width) array per rect (a list unless a single rect tuple was given),
+    # None for rectangles that are not fully in the image
+
+    single = isinstance(rects, tuple)
+    rects = rects_array([rects] if single else rects)
+
+    num_slices, num_rows, num_cols = volume.shape[:3]
+    inside = inside_rects(rects, num_cols = num_cols, num_rows = num_rows)
+    bbx_corners, matrices, sizes = rects_affine(rects)
+
+    crops = []
+    for i in range(len(rects)):
+        if not inside[i]:
+            print("Proposed rectangle is not fully in the image.")
+            crops.append(None)
+            continue
+
+        x0, y0, x1, y1 = bbx_corners[i]
+        rect_width, rect_height = int(sizes[i, 0]), int(sizes[i, 1])
+
+        # Only the bounding box of the rectangle is read from the volume
+        stack = volume[:, y0:y1, x0:x1]
+        cropped = np.empty((num_slices, rect_height, rect_width), dtype=stack.dtype)
+        for z in range(num_slices):
+            cv2.warpAffine(stack[z], matrices[i], (rect_width, rect_height), dst=cropped[z])
+
+        crops.append(cropped)
+
+    return crops[0] if single else crops
+
+
 def crop_rotated_rectangle_test():
     # Test function for crop_rotated_rectangle(image, rect)
 
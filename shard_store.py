@@ -0,0 +1,213 @@
+import os
+import csv
+import json
+import numpy as np
+
+
+# A sharded dataset is a folder with:
+#   meta.json        sample shape and dtype, samples per shard, attrs
+#   shard-NNNNN.bin  raw C-ordered samples, back to back
+#   index.csv        one row per complete sample: key, shard, offset, label
+# Samples are appended to the current shard and only then listed in the
+# index, so after a crash the index names exactly the samples that were
+# fully written and the writer resumes from there.
+META_FILE = "meta.json"
+INDEX_FILE = "index.csv"
+INDEX_COLUMNS = ["key", "shard", "offset", "label"]
+
+
+def shard_name(shard):
+    return f"shard-{shard:05d}.bin"
+
+
+def read_index(path):
+    """Rows of a dataset's index as (key, shard, offset, label) tuples."""
+    index_path = os.path.join(path, INDEX_FILE)
+    if not os.path.exists(index_path):
+        return []
+
+    with open(index_path, newline="") as file:
+        reader = csv.reader(file)
+        next(reader, None)
+        return [(key, int(shard), int(offset), int(label)) for key, shard, offset, label in reader]
+
+
+class ShardWriter:
+    """Append-only writer of fixed-shape samples into fixed-size shards.
+
+    Memory use is one sample regardless of the dataset size. Every sample
+    has a key (e.g. "17/augmented1"); reopening a folder resumes it, and
+    `key in writer` tells which samples are already there. The sample shape
+    and dtype are fixed by the first sample (or by a resumed dataset).
+
+    attrs is a JSON-able dict describing how the samples were made (e.g.
+    processing parameters). Resuming a dataset made with different attrs
+    raises ValueError instead of mixing samples made two ways.
+    """
+
+    def __init__(self, path, samples_per_shard=256, dtype=np.float32, attrs=None):
+        self.path = path
+        self.attrs = dict(attrs or {})
+        os.makedirs(path, exist_ok=True)
+
+        meta_path = os.path.join(path, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path) as file:
+                meta = json.load(file)
+            self.shape = tuple(meta["shape"])
+            self.dtype = np.dtype(meta["dtype"])
+            self.samples_per_shard = meta["samples_per_shard"]
+            if attrs is not None and meta.get("attrs", {}) != json.loads(json.dumps(self.attrs)):
+                raise ValueError(f"{path} was written with {meta.get('attrs', {})}, not {self.attrs}")
+            self.attrs = meta.get("attrs", {})
+        else:
+            self.shape = None
+            self.dtype = np.dtype(dtype)
+            self.samples_per_shard = samples_per_shard
+
+        self._trim_index()
+        rows = read_index(path)
+        self.keys = {row[0] for row in rows}
+        self.count = len(rows)
+        self._file = None
+
+        # A partially written sample after the last indexed one is dropped
+        if self.shape is not None:
+            self._open_shard()
+
+        new_index = not os.path.exists(os.path.join(path, INDEX_FILE))
+        self._index_file = open(os.path.join(path, INDEX_FILE), "a", newline="")
+        self._index = csv.writer(self._index_file)
+        if new_index:
+            self._index.writerow(INDEX_COLUMNS)
+            self._index_file.flush()
+
+    @property
+    def sample_nbytes(self):
+        return int(np.prod(self.shape)) * self.dtype.itemsize
+
+    def _open_shard(self):
+        shard, offset = divmod(self.count, self.samples_per_shard)
+        shard_path = os.path.join(self.path, shard_name(shard))
+        if self._file is not None:
+            self._file.close()
+        self._file = open(shard_path, "r+b" if os.path.exists(shard_path) else "wb")
+        self._file.truncate(offset * self.sample_nbytes)
+        self._file.seek(offset * self.sample_nbytes)
+
+    def _trim_index(self):
+        # An index row cut short by a crash is dropped, along with its sample
+        index_path = os.path.join(self.path, INDEX_FILE)
+        if not os.path.exists(index_path):
+            return
+        with open(index_path, "r+b") as file:
+            content = file.read()
+            if content and not content.endswith(b"\n"):
+                file.truncate(content.rfind(b"\n") + 1)
+
+    def _write_meta(self):
+        meta = {"shape": list(self.shape), "dtype": self.dtype.str, "samples_per_shard": self.samples_per_shard,
+                "attrs": self.attrs}
+        with open(os.path.join(self.path, META_FILE + ".tmp"), "w") as file:
+            json.dump(meta, file)
+        os.replace(os.path.join(self.path, META_FILE + ".tmp"), os.path.join(self.path, META_FILE))
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def __len__(self):
+        return self.count
+
+    def append(self, key, sample, label):
+        """Write one sample; samples with a key that is already in the dataset are skipped."""
+        if key in self.keys:
+            return
+
+        sample = np.ascontiguousarray(sample, dtype=self.dtype)
+        if self.shape is None:
+            self.shape = sample.shape
+            self._write_meta()
+            self._open_shard()
+        elif sample.shape != self.shape:
+            raise ValueError(f"Sample {key} has shape {sample.shape}, the dataset has {self.shape}")
+
+        shard, offset = divmod(self.count, self.samples_per_shard)
+        if offset == 0 and self._file.tell() != 0:
+            self._open_shard()
+
+        # Data first, then the index row, so the index never points at a partial sample
+        self._file.write(sample.tobytes())
+        self._file.flush()
+        self._index.writerow([key, shard, offset, int(label)])
+        self._index_file.flush()
+
+        self.keys.add(key)
+        self.count += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ShardReader:
+    """Random access to a sharded dataset through memory-mapped shards.
+
+    reader[i] is (sample, label) for the i-th indexed sample, read lazily.
+    Shuffling goes through the index (order), the shards are never rewritten.
+    Shards are mapped copy-on-write: samples are writable arrays (so
+    torch.from_numpy can wrap them without a copy), but changes stay in
+    memory and never reach the files.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as file:
+            meta = json.load(file)
+        self.shape = tuple(meta["shape"])
+        self.dtype = np.dtype(meta["dtype"])
+        self.samples_per_shard = meta["samples_per_shard"]
+        self.attrs = meta.get("attrs", {})
+
+        rows = read_index(path)
+        self.keys = [row[0] for row in rows]
+        self.shards = np.array([row[1] for row in rows], dtype=np.int64)
+        self.offsets = np.array([row[2] for row in rows], dtype=np.int64)
+        self.labels = np.array([row[3] for row in rows], dtype=np.int32)
+        self._maps = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def shard(self, shard):
+        """Memory map of one shard as a (samples, *shape) array."""
+        if shard not in self._maps:
+            shard_path = os.path.join(self.path, shard_name(shard))
+            count = os.path.getsize(shard_path) // (int(np.prod(self.shape)) * self.dtype.itemsize)
+            self._maps[shard] = np.memmap(shard_path, dtype=self.dtype, mode="c", shape=(count,) + self.shape)
+        return self._maps[shard]
+
+    def sample(self, i):
+        return self.shard(int(self.shards[i]))[int(self.offsets[i])]
+
+    def __getitem__(self, i):
+        return self.sample(i), self.labels[i]
+
+    def order(self, seed=None):
+        """Shuffled sample order (a permutation of the index)."""
+        return np.random.default_rng(seed).permutation(len(self))
+
+    def arrays(self, order=None):
+        """All samples (in the given order) as an (N, *shape) array, and their labels."""
+        order = np.arange(len(self)) if order is None else np.asarray(order)
+        x = np.empty((len(order),) + self.shape, dtype=self.dtype)
+        for i, j in enumerate(order):
+            x[i] = self.sample(j)
+        return x, self.labels[order]
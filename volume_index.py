@@ -0,0 +1,100 @@
+import os
+import numpy as np
+import pandas as pd
+from volume_store import load_volume
+
+
+# Every stage folder (Array, XY_Crop, Z_Crop, Final) can carry a .metadata.csv
+# with one row per .vol file: its shape, dtype and value range, and what is
+# known about where it came from. Dataset statistics, sanity checks and
+# train/validation splits read this table instead of opening the volumes.
+METADATA_FILE = ".metadata.csv"
+STAMP_COLUMNS = ["bytes", "mtime_ns"]
+STAT_COLUMNS = ["depth", "height", "width", "dtype", "min", "max", "mean"]
+ORIGIN_COLUMNS = ["label", "code", "scan", "study",
+                  "center_x", "center_y", "rect_width", "rect_height", "angle", "z1", "z2"]
+METADATA_COLUMNS = ["name"] + STAT_COLUMNS + ORIGIN_COLUMNS + STAMP_COLUMNS
+
+# Nullable integers, so a missing value doesn't turn a column (or the mtime stamp) into floats
+INTEGER_COLUMNS = ["depth", "height", "width", "label", "z1", "z2", "bytes", "mtime_ns"]
+COLUMN_DTYPES = dict({column: "float64" for column in METADATA_COLUMNS},
+                     **{column: "Int64" for column in INTEGER_COLUMNS},
+                     **{column: "string" for column in ["name", "dtype", "code", "scan", "study"]})
+
+
+def volume_stats(array):
+    """Shape, dtype and min/max/mean of a (z, y, x) array, as metadata columns."""
+    array = np.asarray(array)
+    depth, height, width = array.shape
+    return {"depth": depth, "height": height, "width": width, "dtype": array.dtype.name,
+            "min": float(array.min()), "max": float(array.max()), "mean": float(array.mean(dtype=np.float64))}
+
+
+def crop_name_fields(name):
+    """Label, scan and patient code encoded in a crop name "<NNNN>_<label>_<scan>.vol" ({} for other names)."""
+    parts = os.path.splitext(name)[0].split("_", 2)
+    if len(parts) != 3 or not parts[1].isdigit():
+        return {}
+    _, label, scan = parts
+    return {"label": int(label), "scan": scan, "code": scan.split("-")[0]}
+
+
+def read_metadata(folder):
+    """Metadata index of a stage folder as a DataFrame, one row per volume (see MetadataIndex)."""
+    path = os.path.join(folder, METADATA_FILE)
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=METADATA_COLUMNS).astype(COLUMN_DTYPES)
+    return pd.read_csv(path, dtype=COLUMN_DTYPES)
+
+
+def update_metadata(folder):
+    """Index the volumes of a folder that are new or changed since the last call, and return the index."""
+    index = MetadataIndex(folder)
+    index.refresh()
+    index.save()
+    return read_metadata(folder)
+
+
+class MetadataIndex:
+    """Columnar metadata of the volumes in one folder, kept in <folder>/.metadata.csv.
+
+    rows maps file name -> column -> value. Statistics are stamped with
+    the file's size and mtime when recorded; refresh() reads a volume only
+    when it has no statistics yet or the file changed since, and drops the
+    rows of files that are gone. Origin columns (label, code, crop
+    coordinates...) are filled in by whoever makes the volumes; labels,
+    scans and codes are also parsed from crop names.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = os.path.join(folder, METADATA_FILE)
+        self.rows = {}
+        for row in read_metadata(folder).to_dict("records"):
+            self.rows[row["name"]] = {column: value for column, value in row.items() if not pd.isna(value)}
+
+    def update(self, name, **fields):
+        self.rows.setdefault(name, {"name": name}).update(fields)
+
+    def record(self, name, stats):
+        """Statistics of a volume that was just written (saves reading it back)."""
+        stat = os.stat(os.path.join(self.folder, name))
+        self.update(name, bytes=stat.st_size, mtime_ns=stat.st_mtime_ns, **stats)
+
+    def refresh(self):
+        names = {name for name in os.listdir(self.folder) if name.endswith(".vol")}
+        for name in set(self.rows) - names:
+            del self.rows[name]
+
+        for name in sorted(names):
+            stat = os.stat(os.path.join(self.folder, name))
+            row = self.rows.get(name, {})
+            if row.get("bytes") != stat.st_size or row.get("mtime_ns") != stat.st_mtime_ns:
+                self.update(name, **crop_name_fields(name))
+                self.record(name, volume_stats(load_volume(os.path.join(self.folder, name))))
+
+    def save(self):
+        frame = pd.DataFrame([self.rows[name] for name in sorted(self.rows)], columns=METADATA_COLUMNS, dtype=object)
+        frame = frame.astype(COLUMN_DTYPES)
+        frame.to_csv(self.path + ".tmp", index=False)
+        os.replace(self.path + ".tmp", self.path)
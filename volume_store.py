@@ -0,0 +1,205 @@
+import os
+import json
+import zlib
+import numpy as np
+
+
+# File layout: magic, uint32 header length, JSON header, chunk table, data.
+# Uncompressed volumes store the data as one C-ordered array so the whole
+# file can be memory-mapped; compressed volumes store one zlib stream per chunk.
+MAGIC = b"VOLSTOR1"
+ALIGNMENT = 64
+DEFAULT_CHUNKS = (16, 64, 64)
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def chunk_grid(shape, chunks):
+    """Number of chunks along each axis."""
+    return tuple(-(-size // chunk) for size, chunk in zip(shape, chunks))
+
+
+def save_volume(path, array, compression="zlib", level=1, chunks=DEFAULT_CHUNKS, attrs=None):
+    """Save a 3D array as a chunked volume file.
+
+    compression=None writes the raw array so open_volume can memory-map it;
+    "zlib" compresses every chunk separately so reads only inflate the
+    chunks they touch. attrs is a small JSON-serialisable dict kept in the header.
+    """
+    array = np.asarray(array)
+    if array.ndim != 3:
+        raise ValueError(f"Expected a (z, y, x) volume, got shape {array.shape}")
+    if compression not in (None, "zlib"):
+        raise ValueError(f"Unknown compression {compression!r}")
+
+    chunks = tuple(min(int(c), max(s, 1)) for c, s in zip(chunks, array.shape))
+    grid = chunk_grid(array.shape, chunks)
+    n_chunks = int(np.prod(grid)) if compression else 0
+
+    header = {"shape": list(array.shape),
+              "dtype": array.dtype.str,
+              "chunks": list(chunks),
+              "compression": compression,
+              "attrs": attrs or {}}
+    # Offsets depend on the header length, so reserve room for them first
+    header_bytes = json.dumps(dict(header, table_offset=0, data_offset=0)).encode() + b" " * 32
+    table_offset = _align(len(MAGIC) + 4 + len(header_bytes))
+    data_offset = _align(table_offset + n_chunks * 16)
+    header_bytes = json.dumps(dict(header, table_offset=table_offset, data_offset=data_offset)).encode()
+    header_bytes = header_bytes.ljust(table_offset - len(MAGIC) - 4)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(MAGIC)
+        file.write(len(header_bytes).to_bytes(4, "little"))
+        file.write(header_bytes)
+        file.seek(data_offset)
+
+        if compression is None:
+            file.write(np.ascontiguousarray(array).tobytes())
+        else:
+            table = np.zeros((n_chunks, 2), dtype="<u8")
+            for i, index in enumerate(np.ndindex(*grid)):
+                box = tuple(slice(n * c, (n + 1) * c) for n, c in zip(index, chunks))
+                data = zlib.compress(np.ascontiguousarray(array[box]).tobytes(), level)
+                table[i] = file.tell(), len(data)
+                file.write(data)
+
+            file.seek(table_offset)
+            file.write(table.tobytes())
+
+    os.replace(tmp_path, path)
+
+
+def read_header(path):
+    """Read the header of a volume file (shape, dtype, chunks, attrs) without touching its data."""
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a volume file")
+        length = int.from_bytes(file.read(4), "little")
+        return json.loads(file.read(length))
+
+
+class ChunkedVolume:
+    """Lazy read-only view of a compressed volume file.
+
+    Behaves like a read-only 3D array for shape, dtype and basic slicing;
+    indexing inflates only the chunks that intersect the requested box.
+    """
+
+    def __init__(self, path, header):
+        self.path = path
+        self.shape = tuple(header["shape"])
+        self.dtype = np.dtype(header["dtype"])
+        self.ndim = 3
+        self.size = int(np.prod(self.shape))
+        self.nbytes = self.size * self.dtype.itemsize
+        self.chunks = tuple(header["chunks"])
+        self.attrs = header["attrs"]
+        self.grid = chunk_grid(self.shape, self.chunks)
+
+        self._file = np.memmap(path, dtype=np.uint8, mode="r")
+        n_chunks = int(np.prod(self.grid))
+        self._table = np.frombuffer(self._file, dtype="<u8", count=n_chunks * 2,
+                                    offset=header["table_offset"]).reshape(self.grid + (2,))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _read_chunk(self, index):
+        offset, size = (int(v) for v in self._table[index])
+        data = zlib.decompress(self._file[offset:offset + size])
+        chunk_shape = tuple(min(c, s - n * c) for n, c, s in zip(index, self.chunks, self.shape))
+        return np.frombuffer(data, dtype=self.dtype).reshape(chunk_shape)
+
+    def read_box(self, starts, stops):
+        """Read the sub-box [starts, stops) as a new array."""
+        out = np.empty(tuple(max(b - a, 0) for a, b in zip(starts, stops)), dtype=self.dtype)
+        if out.size == 0:
+            return out
+
+        first = [a // c for a, c in zip(starts, self.chunks)]
+        last = [(b - 1) // c for b, c in zip(stops, self.chunks)]
+        for index in np.ndindex(*(l - f + 1 for f, l in zip(first, last))):
+            index = tuple(f + i for f, i in zip(first, index))
+            lo = [max(a, n * c) for a, n, c in zip(starts, index, self.chunks)]
+            hi = [min(b, (n + 1) * c) for b, n, c in zip(stops, index, self.chunks)]
+            src = tuple(slice(l - n * c, h - n * c) for l, h, n, c in zip(lo, hi, index, self.chunks))
+            dst = tuple(slice(l - a, h - a) for l, h, a in zip(lo, hi, starts))
+            out[dst] = self._read_chunk(index)[src]
+
+        return out
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(k is Ellipsis for k in key):
+            i = key.index(Ellipsis)
+            key = key[:i] + (slice(None),) * (3 - len(key) + 1) + key[i + 1:]
+        key = key + (slice(None),) * (3 - len(key))
+        if len(key) != 3:
+            raise IndexError(f"Too many indices for a 3D volume: {key}")
+
+        # Read the bounding box of the request, then apply steps and integer indices
+        starts, stops, post = [], [], []
+        for k, size in zip(key, self.shape):
+            if isinstance(k, slice):
+                start, stop, step = k.indices(size)
+                if step < 0:
+                    start, stop = stop + 1, start + 1
+                starts.append(start)
+                stops.append(max(stop, start))
+                post.append(slice(None, None, step))
+            else:
+                k = int(k)
+                if not -size <= k < size:
+                    raise IndexError(f"Index {k} out of range for axis of size {size}")
+                k = k % size
+                starts.append(k)
+                stops.append(k + 1)
+                post.append(0)
+
+        return self.read_box(starts, stops)[tuple(post)]
+
+    def __array__(self, dtype=None, copy=None):
+        array = self.read_box((0, 0, 0), self.shape)
+        return array if dtype is None else array.astype(dtype)
+
+    def copy(self):
+        return np.asarray(self)
+
+    def close(self):
+        # Dropping the last references unmaps the file
+        self._file = self._table = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_volume(path):
+    """Open a volume file lazily.
+
+    Uncompressed files come back as a read-only np.memmap, compressed files
+    as a ChunkedVolume; both support .shape, .dtype and slicing without
+    reading the whole volume. Legacy .npz files are loaded eagerly.
+    """
+    if path.endswith(".npz"):
+        with np.load(path) as data:
+            return data["arr_0"]
+
+    header = read_header(path)
+    if header["compression"] is None:
+        return np.memmap(path, dtype=header["dtype"], mode="r",
+                         offset=header["data_offset"], shape=tuple(header["shape"]))
+
+    return ChunkedVolume(path, header)
+
+
+def load_volume(path):
+    """Read a whole volume (or legacy .npz) into memory."""
+    return np.asarray(open_volume(path))